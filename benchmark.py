@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""Воспроизводимые замеры скорости предобработки, обучения и предсказания.
+
+Синтетические пассажиры генерируются по схеме train.csv: если файл доступен,
+строки выбираются из него с возвращением (с шумом в Age и Fare и новыми
+PassengerId), иначе используется встроенный генератор с похожими
+распределениями. Для каждого размера данных замеряются отдельные шаги
+предобработки, время обучения моделей, пропускная способность `predict` и
+задержка предсказания для одного пассажира (p50/p99). Результаты дописываются
+в JSON Lines файл, чтобы сравнивать запуски между изменениями. Вместе с ними
+записываются настройки данных (`RUN_SETTINGS`); запуски с разными настройками
+`compare` сравнивать отказывается.
+
+Примеры запуска:
+
+    python benchmark.py run --sizes 891 100000 1000000 --label baseline
+    python benchmark.py compare
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+from cache import make_key
+from preprocessing import FEATURES, TitanicPreprocessor, preprocess_data
+
+DEFAULT_SIZES = [891, 10_000, 100_000, 1_000_000]
+DEFAULT_RESULTS_PATH = 'benchmarks.jsonl'
+DEFAULT_TEMPLATE_PATH = 'train.csv'
+
+# Обучение бустинга на десятках миллионов строк занимает часы, поэтому модели
+# обучаются не более чем на этом числе строк, а предсказание замеряется на всех
+DEFAULT_MAX_FIT_ROWS = 200_000
+
+# Настройки, от которых зависят данные и замеры; сравнивать можно только запуски с одинаковыми
+RUN_SETTINGS = ['seed', 'data_source', 'template_hash', 'max_fit_rows', 'models']
+
+
+def _models():
+    # Те же настройки, что у моделей в титаник.py: лес без n_jobs, иначе задержка для одной строки
+    # измеряет в основном раздачу задач потокам joblib, а не само предсказание
+    return {
+        'logreg': LogisticRegression(max_iter=200, random_state=42),
+        'random_forest': RandomForestClassifier(n_estimators=100, random_state=42),
+        'gradient_boosting': GradientBoostingClassifier(random_state=42),
+    }
+
+
+def _generate_passengers(n, rng):
+    """Встроенный генератор пассажиров со схемой train.csv."""
+    sex = rng.choice(np.array(['male', 'female'], dtype=object), n, p=[0.65, 0.35])
+    pclass = rng.choice([1, 2, 3], n, p=[0.24, 0.21, 0.55])
+    age = np.round(rng.normal(29.7, 14.5, n).clip(0.42, 80), 1)
+    age[rng.random(n) < 0.2] = np.nan
+    fare = np.round(rng.lognormal(2.7, 1.0, n), 4)
+    embarked = rng.choice(np.array(['S', 'C', 'Q'], dtype=object), n, p=[0.72, 0.19, 0.09])
+    embarked[rng.random(n) < 0.002] = np.nan
+    decks = rng.choice(np.array(list('ABCDEFGT'), dtype=object), n)
+    cabin = pd.Series(decks).str.cat(rng.integers(1, 150, n).astype(str)).to_numpy(dtype=object)
+    cabin[rng.random(n) < 0.77] = np.nan
+    titles = rng.choice(np.array(['Mr', 'Mrs', 'Miss', 'Master', 'Dr', 'Rev'], dtype=object), n,
+                        p=[0.58, 0.14, 0.2, 0.05, 0.02, 0.01])
+    surnames = pd.Series(rng.integers(0, max(n // 3, 1), n).astype(str)).radd('Surname')
+    ticket_prefix = rng.choice(np.array(['', 'PC ', 'A/5 ', 'STON/O2. ', 'CA '], dtype=object), n,
+                               p=[0.74, 0.1, 0.06, 0.05, 0.05])
+    ticket_number = pd.Series(rng.integers(1000, 1000 + max(n // 2, 1), n).astype(str))
+
+    survival_logit = 2.5 * (sex == 'female') - 0.9 * (pclass - 2) - 1.0
+    survived = (rng.random(n) < 1 / (1 + np.exp(-survival_logit))).astype(np.int64)
+
+    return pd.DataFrame({
+        'PassengerId': np.arange(1, n + 1),
+        'Survived': survived,
+        'Pclass': pclass,
+        'Name': (surnames + ', ' + titles + '. John').to_numpy(dtype=object),
+        'Sex': sex,
+        'Age': age,
+        'SibSp': rng.poisson(0.5, n),
+        'Parch': rng.poisson(0.4, n),
+        'Ticket': pd.Series(ticket_prefix).str.cat(ticket_number).to_numpy(dtype=object),
+        'Fare': fare,
+        'Cabin': cabin,
+        'Embarked': embarked,
+    })
+
+
+def make_synthetic_passengers(n, template=None, seed=42):
+    """Генерирует `n` пассажиров со схемой train.csv.
+
+    Если передан `template` (DataFrame из train.csv), строки выбираются из него
+    с возвращением, что сохраняет совместные распределения признаков; к Age и
+    Fare добавляется небольшой шум, PassengerId назначаются заново.
+    """
+    rng = np.random.default_rng(seed)
+    if template is None:
+        return _generate_passengers(n, rng)
+
+    data = template.iloc[rng.integers(0, len(template), n)].reset_index(drop=True)
+    data['PassengerId'] = np.arange(1, n + 1)
+    age_noise = rng.normal(0, 1.0, n)
+    data['Age'] = (data['Age'] + age_noise).clip(lower=0.42).round(1)
+    data['Fare'] = (data['Fare'] * rng.lognormal(0, 0.05, n)).round(4)
+    return data
+
+
+def load_template(path=DEFAULT_TEMPLATE_PATH):
+    return pd.read_csv(path) if path and os.path.exists(path) else None
+
+
+def _best_time(fn, repeat):
+    """Лучшее время из `repeat` запусков: меньше всего зависит от фоновой нагрузки."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _legacy_steps(data):
+    """Шаги предобработки в том виде, в каком они были в исходном скрипте."""
+    def sex_map():
+        data['Sex'].map({'male': 0, 'female': 1})
+
+    def fillna():
+        data['Age'].fillna(data['Age'].median())
+        data['Fare'].fillna(data['Fare'].median())
+        data['Embarked'].fillna(data['Embarked'].mode()[0])
+
+    def cabin_lambda():
+        data['Cabin'].apply(lambda x: x[0] if pd.notnull(x) else 'U')
+
+    def cabin_vectorized():
+        data['Cabin'].str[0].fillna('U')
+
+    def get_dummies():
+        pd.get_dummies(data[['Embarked', 'Pclass']], columns=['Embarked', 'Pclass'], drop_first=True)
+
+    def scaling():
+        StandardScaler().fit_transform(data[['Age', 'Fare']].fillna(0))
+
+    return {
+        'sex_map': sex_map,
+        'fillna': fillna,
+        'cabin_lambda': cabin_lambda,
+        'cabin_vectorized': cabin_vectorized,
+        'get_dummies': get_dummies,
+        'scaling': scaling,
+    }
+
+
+def _latency_percentiles(fn, n_calls):
+    timings = np.empty(n_calls)
+    for i in range(n_calls):
+        start = time.perf_counter()
+        fn()
+        timings[i] = time.perf_counter() - start
+    return np.percentile(timings, 50) * 1000, np.percentile(timings, 99) * 1000
+
+
+def benchmark_size(data, max_fit_rows=DEFAULT_MAX_FIT_ROWS, repeat=3, latency_calls=200):
+    """Замеры для одного набора данных; возвращает список записей."""
+    n = len(data)
+    records = []
+
+    for name, step in _legacy_steps(data).items():
+        seconds = _best_time(step, repeat)
+        records.append({'group': 'preprocessing', 'name': name, 'seconds': seconds, 'rows_per_sec': n / seconds})
+
+    preprocessor = TitanicPreprocessor().fit(data)
+    seconds = _best_time(lambda: preprocess_data(data, preprocessor), repeat)
+    records.append({'group': 'preprocessing', 'name': 'preprocessor_transform', 'seconds': seconds,
+                    'rows_per_sec': n / seconds})
+
+    X = preprocess_data(data, preprocessor)[FEATURES]
+    y = data['Survived']
+    fit_rows = min(n, max_fit_rows)
+    single_row = data.iloc[:1]
+
+    for name, model in _models().items():
+        start = time.perf_counter()
+        model.fit(X.iloc[:fit_rows], y.iloc[:fit_rows])
+        seconds = time.perf_counter() - start
+        records.append({'group': 'fit', 'name': name, 'seconds': seconds, 'rows': fit_rows,
+                        'rows_per_sec': fit_rows / seconds})
+
+        seconds = _best_time(lambda: model.predict(X), repeat)
+        records.append({'group': 'predict', 'name': name, 'seconds': seconds, 'rows_per_sec': n / seconds})
+
+        # Задержка для одного пассажира: предобработка и предсказание, как в онлайн-сервисе
+        p50, p99 = _latency_percentiles(
+            lambda: model.predict(preprocess_data(single_row, preprocessor)[FEATURES]), latency_calls)
+        records.append({'group': 'latency', 'name': name, 'p50_ms': p50, 'p99_ms': p99})
+
+    for record in records:
+        record['size'] = n
+    return records
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, template=None, max_fit_rows=DEFAULT_MAX_FIT_ROWS, repeat=3,
+                   latency_calls=200, label=None, seed=42):
+    """Замеры для всех размеров; возвращает записи с метаданными запуска."""
+    run = {
+        'run_id': uuid.uuid4().hex[:12],
+        'label': label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'sklearn': sklearn.__version__,
+        'pandas': pd.__version__,
+        'seed': seed,
+        # Пассажиры выбираются из train.csv или создаются встроенным генератором
+        'data_source': 'generator' if template is None else 'template',
+        'template_hash': None if template is None else make_key(template),
+        'max_fit_rows': max_fit_rows,
+        'repeat': repeat,
+        'latency_calls': latency_calls,
+        # Отпечаток параметров моделей: после их изменения время с прошлыми запусками не сравнивается
+        'models': make_key({name: model.get_params() for name, model in _models().items()}),
+    }
+    records = []
+    for size in sizes:
+        data = make_synthetic_passengers(size, template, seed)
+        for record in benchmark_size(data, max_fit_rows, repeat, latency_calls):
+            records.append({**run, **record})
+    return records
+
+
+def save_results(records, path=DEFAULT_RESULTS_PATH):
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def load_results(path=DEFAULT_RESULTS_PATH):
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def _check_same_settings(runs, base_id, new_id):
+    """Отказывается сравнивать запуски на разных данных или без записанных настроек."""
+    if 'data_source' not in runs or runs.loc[[base_id, new_id], 'data_source'].isna().any():
+        raise ValueError(f'У запуска {base_id} или {new_id} не записаны настройки данных, '
+                         'сравнение может быть неверным')
+    different = []
+    for setting in RUN_SETTINGS:
+        if setting not in runs:
+            different.append(f'{setting}: не записано')
+            continue
+        base_value, new_value = runs.at[base_id, setting], runs.at[new_id, setting]
+        # template_hash пуст у обоих запусков на встроенном генераторе
+        if not (pd.isna(base_value) and pd.isna(new_value)) and base_value != new_value:
+            different.append(f'{setting}: {base_value} / {new_value}')
+    if different:
+        raise ValueError(f'Запуски {base_id} и {new_id} выполнены с разными настройками: {"; ".join(different)}')
+
+
+def compare_runs(results, base=None, new=None):
+    """Таблица отношения времени нового запуска к базовому (по умолчанию - два последних запуска).
+
+    `base` и `new` - run_id или label. Отношение больше 1 означает замедление.
+    """
+    runs = results.drop_duplicates('run_id')
+    if len(runs) < 2 and (base is None or new is None):
+        raise ValueError('Для сравнения нужно хотя бы два запуска')
+
+    def pick(key, default_pos):
+        if key is None:
+            return runs['run_id'].iloc[default_pos]
+        matches = runs[(runs['run_id'] == key) | (runs['label'] == key)]
+        if matches.empty:
+            raise ValueError(f'Запуск с run_id или меткой {key!r} не найден')
+        return matches['run_id'].iloc[-1]
+
+    base_id, new_id = pick(base, -2), pick(new, -1)
+    _check_same_settings(runs.set_index('run_id'), base_id, new_id)
+    keys = ['group', 'name', 'size']
+    metric = results['seconds'].fillna(results['p99_ms']) if 'p99_ms' in results else results['seconds']
+    table = results.assign(metric=metric)
+    base_table = table[table['run_id'] == base_id].set_index(keys)['metric']
+    new_table = table[table['run_id'] == new_id].set_index(keys)['metric']
+    comparison = pd.DataFrame({'base': base_table, 'new': new_table}).dropna()
+    comparison['ratio'] = comparison['new'] / comparison['base']
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры скорости пайплайна Титаника')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='выполнить замеры')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='размеры наборов данных')
+    run_parser.add_argument('--template', default=DEFAULT_TEMPLATE_PATH, help='train.csv для генерации пассажиров')
+    run_parser.add_argument('--max-fit-rows', type=int, default=DEFAULT_MAX_FIT_ROWS,
+                            help='максимальное число строк для обучения моделей')
+    run_parser.add_argument('--repeat', type=int, default=3, help='число повторов каждого замера')
+    run_parser.add_argument('--latency-calls', type=int, default=200, help='число вызовов для p50/p99')
+    run_parser.add_argument('--label', default=None, help='метка запуска для сравнения')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--output', default=DEFAULT_RESULTS_PATH, help='файл результатов (JSON Lines)')
+
+    compare_parser = subparsers.add_parser('compare', help='сравнить два запуска')
+    compare_parser.add_argument('--base', default=None, help='run_id или метка базового запуска')
+    compare_parser.add_argument('--new', default=None, help='run_id или метка нового запуска')
+    compare_parser.add_argument('--results', default=DEFAULT_RESULTS_PATH, help='файл результатов (JSON Lines)')
+
+    args = parser.parse_args(argv)
+    pd.set_option('display.width', 1000)
+
+    if args.command == 'run':
+        records = run_benchmarks(args.sizes, load_template(args.template), args.max_fit_rows, args.repeat,
+                                 args.latency_calls, args.label, args.seed)
+        save_results(records, args.output)
+        print(pd.DataFrame(records)[['size', 'group', 'name', 'seconds', 'rows_per_sec', 'p50_ms', 'p99_ms']]
+              .to_string(index=False))
+    else:
+        try:
+            table = compare_runs(load_results(args.results), args.base, args.new)
+        except ValueError as error:
+            parser.error(str(error))
+        print(table.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Дисковый кэш результатов обучения на фолдах.
+
+Ключ записи - хэш обучающих данных, списка признаков, класса модели, её
+параметров, фолда и версий sklearn, joblib и NumPy (после обновления
+библиотек модели обучаются заново, а не читаются из старых pickle-файлов). Если
+ничего из этого не изменилось, повторный запуск
+подбора гиперпараметров или кросс-валидации берет точности и обученные модели
+из кэша, а обучает только новые комбинации. Когда суммарный размер кэша
+превышает `max_bytes`, удаляются давно не использованные записи (LRU).
+"""
+
+import hashlib
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from scipy import sparse
+
+DEFAULT_CACHE_DIR = 'titanic_cache'
+DEFAULT_MAX_BYTES = 1 << 30  # 1 ГБ
+
+# От версий зависят и обученные модели, и совместимость их pickle-файлов
+LIBRARY_VERSIONS = {'sklearn': sklearn.__version__, 'joblib': joblib.__version__, 'numpy': np.__version__}
+
+
+def _update_hash(h, obj):
+    if isinstance(obj, pd.DataFrame):
+        h.update(repr(list(obj.columns)).encode())
+        h.update(repr(list(obj.dtypes.astype(str))).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Series):
+        h.update(str(obj.dtype).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(str(obj.dtype).encode())
+        h.update(repr(obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif sparse.issparse(obj):
+        obj = obj.tocsr()
+        h.update(f'{obj.dtype}{obj.shape}'.encode())
+        for part in (obj.indptr, obj.indices, obj.data):
+            h.update(np.ascontiguousarray(part).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            h.update(repr(key).encode())
+            _update_hash(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(repr(type(obj)).encode())
+        for item in obj:
+            _update_hash(h, item)
+    else:
+        h.update(repr(obj).encode())
+    h.update(b'|')
+
+
+def make_key(*parts):
+    """Хэш (sha1) от произвольного набора таблиц, массивов и параметров."""
+    h = hashlib.sha1()
+    for part in parts:
+        _update_hash(h, part)
+    return h.hexdigest()
+
+
+def data_key(X, y):
+    """Хэш обучающих данных и списка признаков; считается один раз на весь подбор."""
+    features = list(X.columns) if hasattr(X, 'columns') else None
+    return make_key(X, y, features)
+
+
+def fold_key(data_hash, estimator, params, fold, test_idx, **extra):
+    """Ключ результата обучения модели `estimator` с параметрами `params` на фолде `fold`."""
+    all_params = {**estimator.get_params(deep=False), **params}
+    estimator_class = f'{type(estimator).__module__}.{type(estimator).__qualname__}'
+    return make_key(data_hash, estimator_class, all_params, fold, np.asarray(test_idx), extra, LIBRARY_VERSIONS)
+
+
+class FoldCache:
+    """Хранилище результатов на фолдах в каталоге `path` с LRU-вытеснением по размеру."""
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.joblib')
+
+    def get(self, key, default=None):
+        path = self._file(key)
+        try:
+            value = joblib.load(path)
+        except FileNotFoundError:
+            return default
+        except Exception:
+            # Поврежденная запись или pickle класса, которого больше нет (переименован, другая
+            # версия библиотеки): считаем промахом и удаляем, результат будет посчитан заново
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return default
+        # Обновляем время изменения: по нему определяется давность использования
+        os.utime(path)
+        return value
+
+    def set(self, key, value):
+        path = self._file(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        joblib.dump(value, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.joblib'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def size(self):
+        """Суммарный размер записей в байтах."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока размер кэша больше `max_bytes`."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, name in self._entries():
+            os.remove(os.path.join(self.path, name))
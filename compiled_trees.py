@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""Быстрое предсказание обученными ансамблями деревьев без sklearn.
+
+`export_ensemble` переводит обученный RandomForestClassifier или бинарный
+GradientBoostingClassifier в плоские массивы NumPy: узлы всех деревьев лежат
+подряд (признак, порог, левый и правый потомок, значение в листе).
+
+Лист, в который попадает строка, находится без обхода дерева по битовым маскам
+(схема QuickScorer). Листья каждого дерева пронумерованы слева направо; у
+каждого узла есть маска листьев, оставшихся достижимыми, если строка уходит
+вправо. Для каждого признака все пороги ансамбля отсортированы, и для каждого
+интервала между соседними порогами заранее вычислено побитовое И масок всех
+узлов, которые строка из этого интервала проходит вправо. Признаки с небольшим
+числом интервалов (пол, one-hot, размер семьи) объединяются в одну таблицу по
+всем сочетаниям значений. Поэтому предсказание сводится к np.searchsorted по
+каждому признаку, выборке нескольких готовых масок и поиску младшего
+установленного бита - самого левого достижимого листа. Если таблицы масок
+получаются слишком большими, используется векторизованный обход деревьев
+по уровням.
+
+Порядок арифметических операций при сложении значений листьев повторяет
+sklearn, поэтому предсказания и вероятности совпадают точно. Строки с NaN или
+бесконечностью не принимаются (ValueError), как и в GradientBoostingClassifier.
+
+Загрузка сохраненного ансамбля требует только NumPy:
+
+    from compiled_trees import CompiledEnsemble
+    model = CompiledEnsemble.load('model.npz')
+    model.predict_proba(X)
+"""
+
+import numpy as np
+
+FOREST = 'forest'
+BOOSTING = 'boosting'
+
+# Строки обрабатываются блоками: маски блока (строки x деревья x слова) должны помещаться в кэш процессора
+DEFAULT_BLOCK_SIZE = 512
+
+# Максимальный размер таблиц масок; для больших ансамблей используется обход деревьев
+MAX_MASK_TABLE_BYTES = 256 * 1024 * 1024
+
+# Признаки объединяются в общую таблицу, пока число сочетаний их интервалов не больше этого
+MAX_GROUP_ROWS = 4096
+
+# С какого размера блока значения деревьев складываются циклом, а не np.add.accumulate
+_LOOP_MIN_ROWS = 64
+
+
+def _word_dtype(max_leaves):
+    """Тип слова маски: uint32 для неглубоких деревьев (бустинг), иначе uint64."""
+    return np.dtype(np.uint32) if max_leaves <= 32 else np.dtype(np.uint64)
+
+
+def _lowest_bit_index(words):
+    """Номер младшего установленного бита каждого слова (для нулевых слов - отрицательное число)."""
+    signed = words.view(f'i{words.itemsize}')
+    lowest_bit = signed & -signed
+    # Степень двойки точно представима в float32, номер бита - это ее двоичный порядок
+    exponent = (lowest_bit.astype(np.float32).view(np.int32) >> 23) & 0xFF
+    return exponent - 127
+
+
+def _first_leaf_index(masks):
+    """Номер первого установленного бита в маске из нескольких слов: (строки, деревья, слова)."""
+    n_words = masks.shape[2]
+    word_bits = masks.itemsize * 8
+    if n_words == 1:
+        return _lowest_bit_index(masks[:, :, 0])
+    if n_words <= 8:
+        # Признаки ненулевых слов (по байту на слово) читаем как одно число и ищем его младший бит
+        nonzero = np.zeros(masks.shape[:2] + (8,), dtype=bool)
+        np.not_equal(masks, 0, out=nonzero[:, :, :n_words])
+        word_index = _lowest_bit_index(nonzero.view(np.uint64)[:, :, 0]) >> 3
+    else:
+        word_index = np.argmax(masks != 0, axis=2)
+    words = np.take_along_axis(masks, word_index[:, :, None], axis=2)[:, :, 0]
+    return _lowest_bit_index(words) + word_index * word_bits
+
+
+def _sequential_sum(values, initial):
+    """Сумма initial и values[0], values[1], ... строго по порядку, как в sklearn."""
+    if values.shape[1] < _LOOP_MIN_ROWS:
+        return np.add.accumulate(np.concatenate([initial[None], values]), axis=0)[-1]
+    # Для больших блоков цикл по деревьям быстрее: каждое сложение - векторная операция по строкам
+    total = initial.copy()
+    for tree_values in values:
+        total += tree_values
+    return total
+
+
+def _flatten_trees(trees, value_fn):
+    features, thresholds, children, values, roots = [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for tree in trees:
+        n_nodes = tree.node_count
+        node_ids = np.arange(n_nodes)
+        is_leaf = tree.children_left == -1
+        # Лист ссылается сам на себя, поэтому лишние шаги обхода его не покидают
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+        left = np.where(is_leaf, node_ids, tree.children_left) + offset
+        right = np.where(is_leaf, node_ids, tree.children_right) + offset
+        # Потомки узла i лежат в children[2 * i] (левый) и children[2 * i + 1] (правый)
+        children.append(np.column_stack([left, right]).ravel().astype(np.int32))
+        values.append(value_fn(tree.value))
+        roots.append(offset)
+        offset += n_nodes
+        max_depth = max(max_depth, tree.max_depth)
+    return {
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'children': np.concatenate(children),
+        'value': np.concatenate(values),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'max_depth': np.int64(max_depth),
+    }
+
+
+def _leaf_order(tree):
+    """Листья дерева слева направо и диапазон номеров листьев в поддереве каждого узла."""
+    left, right = tree.children_left, tree.children_right
+    leaves = []
+    first_leaf = np.zeros(tree.node_count, dtype=np.int64)
+    end_leaf = np.zeros(tree.node_count, dtype=np.int64)
+    # Обход в глубину слева направо без рекурсии: (узел, пройдено ли уже поддерево)
+    stack = [(0, False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            end_leaf[node] = len(leaves)
+            continue
+        first_leaf[node] = len(leaves)
+        if left[node] == -1:
+            leaves.append(node)
+            end_leaf[node] = len(leaves)
+            continue
+        stack.append((node, True))
+        stack.append((right[node], False))
+        stack.append((left[node], False))
+    return np.asarray(leaves, dtype=np.int64), first_leaf, end_leaf
+
+
+def _feature_table(trees, orders, feature, thresholds, n_words, dtype):
+    """Маски для каждого интервала между порогами признака: (интервалы, деревья, слова)."""
+    table = np.full((len(thresholds) + 1, len(trees), n_words), np.iinfo(dtype).max, dtype=dtype)
+    for t, (tree, (_, first_leaf, end_leaf)) in enumerate(zip(trees, orders)):
+        for node in np.flatnonzero((tree.children_left != -1) & (tree.feature == feature)):
+            # Уходя вправо, строка не может попасть в листья левого поддерева
+            left_child = tree.children_left[node]
+            bits = np.zeros(n_words * dtype.itemsize * 8, dtype=bool)
+            bits[first_leaf[left_child]:end_leaf[left_child]] = True
+            j = np.searchsorted(thresholds, tree.threshold[node])
+            table[j + 1, t] &= ~np.packbits(bits, bitorder='little').view(dtype)
+    # В интервал j попадают значения больше первых j порогов: накопленное И по интервалам
+    np.bitwise_and.accumulate(table, axis=0, out=table)
+    return table
+
+
+def _mask_tables(trees, n_features):
+    """Таблицы масок для поиска листьев без обхода (None, если они слишком большие)."""
+    orders = [_leaf_order(tree) for tree in trees]
+    n_trees = len(trees)
+    max_leaves = max(len(leaves) for leaves, _, _ in orders)
+    dtype = _word_dtype(max_leaves)
+    word_bits = dtype.itemsize * 8
+    n_words = (max_leaves + word_bits - 1) // word_bits
+
+    feature_thresholds = [
+        np.unique(np.concatenate([tree.threshold[(tree.children_left != -1) & (tree.feature == f)]
+                                  for tree in trees]))
+        for f in range(n_features)
+    ]
+    # Объединяем признаки в группы, начиная с тех, у которых меньше всего интервалов
+    used = sorted((f for f in range(n_features) if len(feature_thresholds[f])),
+                  key=lambda f: len(feature_thresholds[f]))
+    groups = []
+    for f in used:
+        n_bins = len(feature_thresholds[f]) + 1
+        if groups and groups[-1][1] * n_bins <= MAX_GROUP_ROWS:
+            groups[-1] = (groups[-1][0] + [f], groups[-1][1] * n_bins)
+        else:
+            groups.append(([f], n_bins))
+    if sum(n_rows for _, n_rows in groups) * n_trees * n_words * dtype.itemsize > MAX_MASK_TABLE_BYTES:
+        return None
+
+    tables = []
+    for group_features, _ in groups:
+        # Строка таблицы группы - номер сочетания интервалов, первый признак - старший разряд
+        table = None
+        for f in group_features:
+            feature_table = _feature_table(trees, orders, f, feature_thresholds[f], n_words, dtype)
+            if table is None:
+                table = feature_table
+            else:
+                table = (table[:, None] & feature_table[None, :]).reshape(-1, n_trees, n_words)
+        tables.append(table)
+    if not tables:
+        # Все деревья состоят из одного листа
+        tables.append(np.full((1, n_trees, n_words), np.iinfo(dtype).max, dtype=dtype))
+        groups.append(([], 1))
+
+    leaf_nodes = np.full((n_trees, max_leaves), -1, dtype=np.int64)
+    for t, (leaves, _, _) in enumerate(orders):
+        leaf_nodes[t, :len(leaves)] = leaves
+
+    return {
+        'qs_masks': np.concatenate(tables),
+        'qs_table_offsets': np.cumsum([0] + [len(table) for table in tables[:-1]]).astype(np.int64),
+        'qs_group_sizes': np.asarray([len(group_features) for group_features, _ in groups], dtype=np.int64),
+        'qs_group_features': np.asarray([f for group_features, _ in groups for f in group_features],
+                                        dtype=np.int64),
+        'qs_thresholds': np.concatenate(feature_thresholds).astype(np.float64),
+        'qs_threshold_offsets': np.cumsum([0] + [len(t) for t in feature_thresholds]).astype(np.int64),
+        'qs_leaf_nodes': leaf_nodes,
+    }
+
+
+def _flatten_ensemble(trees, value_fn, n_features):
+    arrays = _flatten_trees(trees, value_fn)
+    tables = _mask_tables(trees, n_features)
+    if tables is not None:
+        # Номера листьев в таблицах - локальные для дерева, переводим в сквозную нумерацию узлов
+        leaf_nodes = tables['qs_leaf_nodes']
+        offsets = arrays['roots'].astype(np.int64)[:, None]
+        tables['qs_leaf_nodes'] = np.where(leaf_nodes >= 0, leaf_nodes + offsets, 0)
+        arrays.update(tables)
+    return arrays
+
+
+def export_ensemble(model):
+    """Переводит обученный ансамбль деревьев в `CompiledEnsemble`."""
+    from sklearn.dummy import DummyClassifier
+    from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+
+    if isinstance(model, RandomForestClassifier):
+        if model.n_outputs_ != 1:
+            raise ValueError('Поддерживается только лес с одной целевой переменной')
+        # В tree_.value у классификаторов хранятся доли классов в листе
+        arrays = _flatten_ensemble([est.tree_ for est in model.estimators_], lambda value: value[:, 0, :],
+                                   model.n_features_in_)
+        arrays.update(kind=np.array(FOREST), classes=model.classes_)
+    elif isinstance(model, GradientBoostingClassifier):
+        if model.n_trees_per_iteration_ != 1:
+            raise ValueError('Поддерживается только бинарный градиентный бустинг')
+        prior_init = isinstance(model.init_, DummyClassifier) and model.init_.strategy == 'prior'
+        if model.init_ != 'zero' and not prior_init:
+            raise ValueError('Поддерживается только init=None (априорные вероятности) или init="zero"')
+        # Начальное приближение для априорных вероятностей не зависит от X
+        init_raw = model._raw_predict_init(np.zeros((1, model.n_features_in_), dtype=np.float32))[0, 0]
+        arrays = _flatten_ensemble([est.tree_ for est in model.estimators_[:, 0]], lambda value: value[:, 0, 0],
+                                   model.n_features_in_)
+        arrays.update(kind=np.array(BOOSTING), classes=model.classes_,
+                      init_raw=np.float64(init_raw), learning_rate=np.float64(model.learning_rate))
+    else:
+        raise TypeError(f'Неподдерживаемая модель: {type(model).__name__}')
+
+    arrays['n_features'] = np.int64(model.n_features_in_)
+    if hasattr(model, 'feature_names_in_'):
+        arrays['feature_names'] = np.asarray(model.feature_names_in_, dtype=str)
+    return CompiledEnsemble(arrays)
+
+
+class CompiledEnsemble:
+    """Ансамбль деревьев в виде плоских массивов с векторизованным предсказанием."""
+
+    def __init__(self, arrays, block_size=DEFAULT_BLOCK_SIZE):
+        self.arrays = arrays
+        self.kind = str(arrays['kind'])
+        self.classes_ = arrays['classes']
+        self.feature_names_in_ = arrays.get('feature_names')
+        # Отпечаток предобработки, с которой обучена модель (см. score.save_model)
+        fingerprint = arrays.get('preprocessor_fingerprint')
+        self.preprocessor_fingerprint_ = str(fingerprint) if fingerprint is not None else None
+        self.block_size = block_size
+        self._feature = arrays['feature']
+        self._threshold = arrays['threshold']
+        self._children = arrays['children']
+        self._value = arrays['value']
+        self._roots = arrays['roots']
+        self._max_depth = int(arrays['max_depth'])
+        self._n_trees = len(self._roots)
+
+        self._has_masks = 'qs_masks' in arrays
+        if self._has_masks:
+            self._masks = arrays['qs_masks']
+            leaf_nodes = arrays['qs_leaf_nodes']
+            # Значения листьев в порядке (дерево, номер листа слева направо)
+            self._leaf_values = self._value[leaf_nodes.ravel()]
+            self._tree_leaf_offsets = np.arange(self._n_trees) * leaf_nodes.shape[1]
+            thresholds, threshold_offsets = arrays['qs_thresholds'], arrays['qs_threshold_offsets']
+            group_features = iter(arrays['qs_group_features'].tolist())
+            self._groups = []
+            for table_offset, size in zip(arrays['qs_table_offsets'].tolist(), arrays['qs_group_sizes'].tolist()):
+                features = []
+                for f in [next(group_features) for _ in range(size)]:
+                    feature_thresholds = thresholds[threshold_offsets[f]:threshold_offsets[f + 1]]
+                    features.append((f, feature_thresholds, len(feature_thresholds) + 1))
+                self._groups.append((table_offset, features))
+
+    def save(self, path):
+        arrays = dict(self.arrays)
+        if self.preprocessor_fingerprint_ is not None:
+            arrays['preprocessor_fingerprint'] = np.array(self.preprocessor_fingerprint_)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def _as_array(self, X):
+        if self.feature_names_in_ is not None and hasattr(X, 'columns'):
+            X = X[list(self.feature_names_in_)]
+        # Как и sklearn, сравниваем с порогами значения, приведенные к float32
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        # Пропуски sklearn направляет в лесу по missing_go_to_left, а бустинг их не принимает; маски и
+        # обход деревьев этого не повторяют, поэтому, как и бустинг, отклоняем такие строки
+        if not np.isfinite(X).all():
+            raise ValueError('Входные данные содержат NaN или бесконечность')
+        return X
+
+    def _leaf_values_by_masks(self, X):
+        masks = None
+        for table_offset, features in self._groups:
+            # Номер интервала = число порогов меньше значения = число узлов признака, где строка уходит вправо
+            code = np.zeros(len(X), dtype=np.intp)
+            for f, thresholds, n_bins in features:
+                code = code * n_bins + np.searchsorted(thresholds, X[:, f])
+            rows = self._masks[code + table_offset]
+            if masks is None:
+                masks = rows
+            else:
+                masks &= rows
+
+        # Самый левый достижимый лист - первый установленный бит маски
+        # Значения собираем по деревьям (деревья, строки), чтобы складывать их построчно
+        leaf_index = _first_leaf_index(masks) + self._tree_leaf_offsets
+        return self._leaf_values[np.ascontiguousarray(leaf_index.T)]
+
+    def _leaf_values_by_traversal(self, X):
+        n_rows, n_features = X.shape
+        X_flat = X.ravel()
+        row_offsets = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        nodes = np.repeat(self._roots[None, :], n_rows, axis=0).astype(np.intp)
+        for _ in range(self._max_depth):
+            go_right = X_flat[row_offsets + self._feature[nodes]] > self._threshold[nodes]
+            nodes = self._children[2 * nodes + go_right]
+        return self._value[np.ascontiguousarray(nodes.T)]
+
+    def _leaf_values_of(self, X):
+        """Значения листьев, в которые попадает каждая строка в каждом дереве: (деревья, строки, ...)."""
+        if self._has_masks:
+            return self._leaf_values_by_masks(X)
+        return self._leaf_values_by_traversal(X)
+
+    def _blocks(self, X):
+        for start in range(0, len(X), self.block_size):
+            yield X[start:start + self.block_size]
+
+    def _forest_proba(self, X):
+        # Складываем вероятности деревьев по порядку, как sklearn, а затем делим на число деревьев
+        values = self._leaf_values_of(X)
+        return _sequential_sum(values, np.zeros(values.shape[1:])) / self._n_trees
+
+    def _boosting_raw(self, X):
+        # Начальное приближение плюс вклады стадий, сложенные последовательно, как в sklearn
+        init = np.full(len(X), self.arrays['init_raw'], dtype=np.float64)
+        return _sequential_sum(self.arrays['learning_rate'] * self._leaf_values_of(X), init)
+
+    def decision_function(self, X):
+        if self.kind != BOOSTING:
+            raise AttributeError('decision_function есть только у градиентного бустинга')
+        X = self._as_array(X)
+        blocks = [self._boosting_raw(block) for block in self._blocks(X)]
+        return np.concatenate(blocks) if blocks else np.empty(0)
+
+    def predict_proba(self, X):
+        if self.kind == FOREST:
+            blocks = [self._forest_proba(block) for block in self._blocks(self._as_array(X))]
+            return np.concatenate(blocks) if blocks else np.empty((0, len(self.classes_)))
+        from scipy.special import expit
+
+        proba_1 = expit(self.decision_function(X))
+        return np.column_stack([1 - proba_1, proba_1])
+
+    def predict(self, X):
+        if self.kind == FOREST:
+            return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+        return self.classes_[(self.decision_function(X) >= 0).astype(int)]
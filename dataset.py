@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Компактный колоночный формат для матрицы признаков.
+
+Набор данных - это каталог, в котором каждый столбец хранится отдельным
+двоичным файлом `<столбец>.bin` с узким типом (uint8 для пола, Is_Alone и
+one-hot признаков, float32 для Age и Fare), а `meta.json` описывает число
+строк, столбцы, их типы и отпечаток предобработки, которой получены признаки
+(по нему score.py проверяет, что модель обучена с той же предобработкой). Столбцы открываются через np.memmap, поэтому
+обучение и предсказание начинаются без разбора CSV и без копирования данных.
+
+Пример экспорта:
+
+    python dataset.py train.csv train_features --target Survived
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import FEATURE_DTYPES, FEATURES, RAW_COLUMNS, TitanicPreprocessor, preprocess_data
+
+META_FILE = 'meta.json'
+
+ID_COLUMN = 'PassengerId'
+TARGET_COLUMN = 'Survived'
+
+ID_DTYPE = np.int64
+TARGET_DTYPE = np.uint8
+
+
+def _column_file(path, name):
+    return os.path.join(path, f'{name}.bin')
+
+
+class DatasetWriter:
+    """Дописывает блоки данных в колоночный набор; метаданные записываются при закрытии."""
+
+    def __init__(self, path, dtypes, target=None, id_column=None, preprocessor_fingerprint=None):
+        self.path = path
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in dtypes.items()}
+        self.target = target
+        self.id_column = id_column
+        self.preprocessor_fingerprint = preprocessor_fingerprint
+        self.n_rows = 0
+        os.makedirs(path, exist_ok=True)
+        self._files = {name: open(_column_file(path, name), 'wb') for name in self.dtypes}
+
+    def append(self, frame):
+        for name, dtype in self.dtypes.items():
+            column = frame[name]
+            if column.isna().any():
+                raise ValueError(f'Столбец {name} содержит пропуски и не может быть сохранен как {dtype}')
+            values = column.to_numpy()
+            # Приведение типа молча переполняется (300 в uint8 дает 44), поэтому диапазон проверяем заранее
+            info = np.iinfo(dtype) if dtype.kind in 'iu' else np.finfo(dtype)
+            if len(values) and (values.min() < info.min or values.max() > info.max):
+                raise ValueError(f'Столбец {name} содержит значения вне диапазона {dtype} '
+                                 f'[{info.min}, {info.max}]')
+            self._files[name].write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        self.n_rows += len(frame)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        meta = {
+            'n_rows': self.n_rows,
+            'columns': [{'name': name, 'dtype': dtype.str} for name, dtype in self.dtypes.items()],
+            'target': self.target,
+            'id': self.id_column,
+            'preprocessor_fingerprint': self.preprocessor_fingerprint,
+        }
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _dataset_dtypes(features, target, id_column):
+    dtypes = {}
+    if id_column is not None:
+        dtypes[id_column] = ID_DTYPE
+    dtypes.update({name: FEATURE_DTYPES.get(name, np.float32) for name in features})
+    if target is not None:
+        dtypes[target] = TARGET_DTYPE
+    return dtypes
+
+
+def save_feature_matrix(path, X, y=None, ids=None, preprocessor=None):
+    """Сохраняет матрицу признаков `X` (и при наличии целевую переменную и идентификаторы).
+
+    `preprocessor` - предобработка, которой получены признаки; ее отпечаток записывается в `meta.json`.
+    """
+    frame = X.copy()
+    target = id_column = None
+    if y is not None:
+        target = y.name if getattr(y, 'name', None) else TARGET_COLUMN
+        frame[target] = np.asarray(y)
+    if ids is not None:
+        id_column = ids.name if getattr(ids, 'name', None) else ID_COLUMN
+        frame[id_column] = np.asarray(ids)
+
+    fingerprint = preprocessor.fingerprint() if preprocessor is not None else None
+    with DatasetWriter(path, _dataset_dtypes(list(X.columns), target, id_column), target, id_column,
+                       fingerprint) as writer:
+        writer.append(frame)
+
+
+def load_meta(path):
+    """Метаданные набора данных из `meta.json`."""
+    with open(os.path.join(path, META_FILE)) as f:
+        return json.load(f)
+
+
+def load_feature_matrix(path, mmap=True):
+    """Загружает набор данных, возвращает (X, y, ids); y и ids равны None, если их нет.
+
+    При mmap=True столбцы не читаются в память, а отображаются из файлов.
+    """
+    meta = load_meta(path)
+
+    n_rows = meta['n_rows']
+    columns = {}
+    for column in meta['columns']:
+        dtype = np.dtype(column['dtype'])
+        file = _column_file(path, column['name'])
+        if n_rows == 0:
+            columns[column['name']] = np.empty(0, dtype=dtype)
+        elif mmap:
+            columns[column['name']] = np.memmap(file, dtype=dtype, mode='r', shape=(n_rows,))
+        else:
+            columns[column['name']] = np.fromfile(file, dtype=dtype, count=n_rows)
+
+    target, id_column = meta['target'], meta['id']
+    y = pd.Series(columns.pop(target), name=target, copy=False) if target else None
+    ids = pd.Series(columns.pop(id_column), name=id_column, copy=False) if id_column else None
+    # copy=False: столбцы DataFrame остаются отображениями файлов
+    X = pd.DataFrame(columns, copy=False)
+    return X, y, ids
+
+
+def export_csv(csv_path, path, preprocessor, target=None, chunksize=100_000):
+    """Переводит CSV с пассажирами в колоночный набор признаков, читая файл блоками."""
+    usecols = [ID_COLUMN] + RAW_COLUMNS + ([target] if target else [])
+    with DatasetWriter(path, _dataset_dtypes(FEATURES, target, ID_COLUMN), target, ID_COLUMN,
+                       preprocessor.fingerprint()) as writer:
+        for chunk in pd.read_csv(csv_path, usecols=usecols, chunksize=chunksize):
+            frame = preprocess_data(chunk, preprocessor)[FEATURES]
+            frame[ID_COLUMN] = chunk[ID_COLUMN].to_numpy()
+            if target:
+                frame[target] = chunk[target].to_numpy()
+            writer.append(frame)
+    return writer.n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Экспорт признаков пассажиров в колоночный двоичный формат')
+    parser.add_argument('input', help='CSV-файл с пассажирами')
+    parser.add_argument('output', help='каталог для набора данных')
+    parser.add_argument('--preprocessor', default='preprocessor.joblib', help='сохраненная предобработка (joblib)')
+    parser.add_argument('--target', default=None, help='целевой столбец, например Survived')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='размер блока в строках')
+    args = parser.parse_args(argv)
+
+    preprocessor = TitanicPreprocessor.load(args.preprocessor)
+    n_rows = export_csv(args.input, args.output, preprocessor, args.target, args.chunksize)
+    print(f'Сохранено строк: {n_rows}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Матрица признаков для моделей: плотная таблица или разреженная CSR-матрица.
+
+Матрица состоит из признаков `FEATURES` (preprocessing.py), признаков из
+имени, билета и каюты `TEXT_FEATURES` и хешированных значений
+(text_features.py). Почти все столбцы - one-hot и хеши, то есть в основном
+нули, поэтому в разреженном виде хранятся только ненулевые значения в
+float32 (индексы столбцов - int32). LogisticRegression, RandomForestClassifier
+и GradientBoostingClassifier обучаются и предсказывают на CSR без
+преобразования в плотную матрицу, а float32 совпадает с типом, к которому
+деревья sklearn приводят данные сами.
+
+Матрица используется для сравнения плотного и разреженного вариантов и для
+оценки новых признаков в `титаник.py`. Подобранные и сохраненные модели, а
+также score.py, server.py и incremental.py по-прежнему работают с плотной
+таблицей из `FEATURES`.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from preprocessing import FEATURES, preprocess_data
+from text_features import TEXT_FEATURES
+
+DESIGN_DTYPE = np.float32
+
+
+def hashed_feature_names(n_hash_features):
+    return [f'hash_{i}' for i in range(n_hash_features)]
+
+
+def design_feature_names(text_features=None):
+    names = list(FEATURES)
+    if text_features is not None:
+        names += TEXT_FEATURES + hashed_feature_names(text_features.n_hash_features)
+    return names
+
+
+def build_design_matrix(data, preprocessor, text_features=None, sparse_output=True, dtype=DESIGN_DTYPE,
+                        training=False):
+    """Строит матрицу признаков для моделей.
+
+    С `sparse_output=True` возвращает CSR-матрицу типа `dtype`; иначе - плотную
+    таблицу float64, как при обучении на DataFrame из `FEATURES`. Порядок
+    столбцов в обоих случаях - `design_feature_names(text_features)`.
+    `training=True` - `data` та же выборка, на которой обучен `text_features`
+    (см. `TextFeatures.transform`).
+    """
+    blocks = [preprocess_data(data, preprocessor)[FEATURES]]
+    if text_features is not None:
+        blocks.append(text_features.transform(data, training=training))
+
+    if sparse_output:
+        parts = [sparse.csr_matrix(block.to_numpy(dtype=dtype)) for block in blocks]
+        if text_features is not None:
+            parts.append(text_features.transform_hashed(data).astype(dtype))
+        matrix = sparse.hstack(parts, format='csr', dtype=dtype)
+        matrix.sort_indices()
+        return matrix
+
+    frame = pd.concat(blocks, axis=1).astype(np.float64)
+    if text_features is not None:
+        hashed = text_features.transform_hashed(data).toarray().astype(np.float64)
+        names = hashed_feature_names(text_features.n_hash_features)
+        frame = pd.concat([frame, pd.DataFrame(hashed, columns=names, index=frame.index)], axis=1)
+    return frame
+
+
+def matrix_nbytes(X):
+    """Объем памяти матрицы признаков в байтах (для CSR - данные и индексы)."""
+    if sparse.issparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    if isinstance(X, pd.DataFrame):
+        return int(X.memory_usage(index=False).sum())
+    return X.nbytes
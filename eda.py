@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Разведочный анализ данных пассажиров Титаника: корреляции и графики.
+
+Этап необязательный: `титаник.py` импортирует модуль только без флага
+`--headless`, поэтому при обучении и предсказании без анализа matplotlib
+и seaborn не загружаются. Функции не изменяют переданный DataFrame.
+
+Без дисплея (например, на сервере) графики можно сохранить в файлы:
+
+    plot_survival(train, output_dir='plots')
+"""
+
+import os
+
+from preprocessing import SEX_MAP
+
+
+def survival_correlation(train):
+    """Корреляция числовых признаков (и пола) с выживаемостью, по убыванию."""
+    data = train.assign(Sex=train['Sex'].map(SEX_MAP))
+    # Нечисловые столбцы, такие как Name и Ticket, в корреляцию не входят
+    numeric_features = data.select_dtypes(include=['int64', 'float64'])
+    return numeric_features.corr()['Survived'].sort_values(ascending=False)
+
+
+def with_engineered_features(train, preprocessor):
+    """Копия данных с заполненными пропусками, буквой каюты, Family_Size и Is_Alone для просмотра."""
+    data = train.copy()
+    data['Age'] = data['Age'].fillna(preprocessor.age_median_)
+    data['Embarked'] = data['Embarked'].fillna(preprocessor.embarked_mode_)
+    # Первая буква каюты; U - неизвестная каюта
+    data['Cabin'] = data['Cabin'].str[0].fillna('U')
+    data['Family_Size'] = data['SibSp'] + data['Parch'] + 1
+    data['Is_Alone'] = (data['Family_Size'] == 1).astype(int)
+    return data
+
+
+def plot_survival(train, output_dir=None):
+    """Строит графики выживаемости по полу и классу и распределение возраста.
+
+    Если задан `output_dir`, графики сохраняются туда в PNG, иначе показываются.
+    """
+    import matplotlib
+
+    if output_dir is not None:
+        # Сохранение в файлы не требует дисплея
+        matplotlib.use('Agg')
+        os.makedirs(output_dir, exist_ok=True)
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.style.use('seaborn-v0_8' if 'seaborn-v0_8' in plt.style.available else 'seaborn')
+
+    def finish(name):
+        if output_dir is None:
+            plt.show()
+        else:
+            plt.savefig(os.path.join(output_dir, f'{name}.png'), bbox_inches='tight')
+            plt.close()
+
+    data = train.assign(Sex=train['Sex'].map(SEX_MAP))
+
+    # Распределение выживших и невыживших
+    plt.figure()
+    sns.countplot(x='Survived', data=data)
+    plt.title('Распределение выживших и погибших')
+    plt.xlabel('Выжил (1) или нет (0)')
+    plt.ylabel('Количество пассажиров')
+    finish('survived')
+
+    # Взаимосвязь пола и выживаемости
+    plt.figure()
+    sns.countplot(x='Survived', hue='Sex', data=data)
+    plt.title('Выживаемость в зависимости от пола')
+    plt.xlabel('Выжил (1) или нет (0)')
+    plt.ylabel('Количество пассажиров')
+    plt.legend(title='Пол', loc='upper right')
+    finish('survived_by_sex')
+
+    # Взаимосвязь класса и выживаемости
+    plt.figure()
+    sns.countplot(x='Survived', hue='Pclass', data=data)
+    plt.title('Выживаемость в зависимости от класса')
+    plt.xlabel('Выжил (1) или нет (0)')
+    plt.ylabel('Количество пассажиров')
+    plt.legend(title='Класс', loc='upper right')
+    finish('survived_by_class')
+
+    # Распределение возраста
+    plt.figure(figsize=(10, 6))
+    sns.histplot(data['Age'].dropna(), bins=30)
+    plt.title('Распределение возраста пассажиров')
+    plt.xlabel('Возраст')
+    plt.ylabel('Количество пассажиров')
+    finish('age')
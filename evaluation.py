@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Оценка моделей кросс-валидацией за один проход.
+
+`cross_val_predict` и `cross_val_score` на одних и тех же фолдах обучают
+модель дважды. `evaluate_cv` обучает модель на каждом фолде один раз
+(фолды - параллельно) и сразу возвращает предсказания вне фолда, точность по
+каждому фолду и отчет о классификации. С параметром `cache`
+(`cache.FoldCache`) предсказания и модели на фолдах берутся с диска, если
+данные, модель и фолды не изменились.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, classification_report
+from sklearn.model_selection import check_cv
+
+from cache import data_key, fold_key
+
+
+@dataclass
+class CVResult:
+    """Результат кросс-валидации модели."""
+    predictions: np.ndarray  # предсказания вне фолда для каждой строки
+    fold_scores: np.ndarray  # accuracy на каждом фолде
+    report: str  # отчет о классификации по предсказаниям вне фолда
+
+    @property
+    def mean_score(self):
+        return self.fold_scores.mean()
+
+
+def _take(data, idx):
+    return data.iloc[idx] if hasattr(data, 'iloc') else data[idx]
+
+
+def _fit_fold(estimator, X, y, train_idx, test_idx):
+    model = clone(estimator).fit(_take(X, train_idx), _take(y, train_idx))
+    X_test = _take(X, test_idx)
+    result = {'predictions': model.predict(X_test), 'model': model}
+    # Вероятности вне фолда нужны стекингу (stacking.py), он читает те же записи кэша
+    if hasattr(model, 'predict_proba'):
+        result['proba'] = model.predict_proba(X_test)
+    return result
+
+
+def evaluate_cv(estimator, X, y, cv=5, n_jobs=-1, cache=None):
+    """Кросс-валидация с однократным обучением модели на каждом фолде.
+
+    Фолды те же, что у `cross_val_predict`/`cross_val_score` с тем же `cv`.
+    """
+    cv = check_cv(cv, y, classifier=True)
+    splits = list(cv.split(X, y))
+    results = [None] * len(splits)
+    if cache is not None:
+        data_hash = data_key(X, y)
+        keys = [fold_key(data_hash, estimator, {}, fold, test_idx) for fold, (_, test_idx) in enumerate(splits)]
+        results = [cache.get(key) for key in keys]
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    fitted = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_fold)(estimator, X, y, *splits[i]) for i in missing
+    )
+    for i, result in zip(missing, fitted):
+        results[i] = result
+        if cache is not None:
+            cache.set(keys[i], result)
+    fold_predictions = [result['predictions'] for result in results]
+
+    y_true = np.asarray(y)
+    predictions = np.empty_like(y_true)
+    fold_scores = np.empty(len(splits))
+    for i, ((_, test_idx), pred) in enumerate(zip(splits, fold_predictions)):
+        predictions[test_idx] = pred
+        fold_scores[i] = accuracy_score(y_true[test_idx], pred)
+
+    return CVResult(predictions, fold_scores, classification_report(y_true, predictions))
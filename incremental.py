@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""Инкрементальное дообучение на новых пакетах размеченных пассажиров.
+
+Вместо повторного запуска всего `титаник.py` новый пакет строк:
+
+1. сравнивается с обучающей выборкой последнего полного подбора: индекс
+   стабильности популяции (PSI) по каждому исходному столбцу и точность
+   текущей модели на пакете против точности на кросс-валидации;
+2. если сдвиг ниже порогов - дообучает предобработку (`partial_fit`:
+   медианы и мода по накопленным частотам, масштаб по потоковым моментам),
+   логистическую регрессию (warm start на последних `history_size` строках) и
+   добавляет в лес и бустинг новые деревья, обученные на пакете (warm start);
+3. если сдвиг выше порогов - модели не меняются, нужен полный подбор
+   гиперпараметров (`титаник.py`).
+
+Пороги по умолчанию: PSI > 0.2 (заметный сдвиг распределения) или падение
+точности больше чем на 0.05. Пример запуска:
+
+    python incremental.py new_passengers.csv
+
+После дообучения заново сохраняются предобработка и все модели, которые
+сохраняет `титаник.py` и которые здесь обновляются (`model.joblib`,
+`model.npz`, `model_rf.npz`), каждая с отпечатком новой предобработки.
+Стекинг (`model_stacking.joblib`) здесь не дообучается: его отпечаток больше
+не совпадает, и `score.py`/`server.py` откажутся применять его до полного
+перезапуска `титаник.py`.
+"""
+
+import argparse
+import copy
+import sys
+from dataclasses import dataclass, field
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score
+
+from preprocessing import FEATURES, RAW_COLUMNS, SCALED_COLUMNS, preprocess_data
+from score import save_model
+
+DEFAULT_STATE_PATH = 'incremental.joblib'
+TARGET_COLUMN = 'Survived'
+
+PSI_THRESHOLD = 0.2
+ACCURACY_DROP_THRESHOLD = 0.05
+DEFAULT_PSI_BINS = 10
+
+# Окно последних размеченных строк для логистической регрессии: на 100 тыс. строк
+# переобучение с warm start занимает сотые доли секунды, а окно в состоянии - около 17 МБ
+DEFAULT_HISTORY_SIZE = 100_000
+
+# Столбцы, распределение которых сравнивается по категориям, а не по интервалам
+CATEGORICAL_COLUMNS = ['Sex', 'Pclass', 'Embarked']
+
+# Доля вместо нулевой, чтобы PSI оставался конечным
+_MIN_PROPORTION = 1e-4
+
+
+def population_stability_index(expected, actual):
+    """PSI между долями строк в одних и тех же интервалах (категориях)."""
+    expected = np.clip(np.asarray(expected, dtype=np.float64), _MIN_PROPORTION, None)
+    actual = np.clip(np.asarray(actual, dtype=np.float64), _MIN_PROPORTION, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+@dataclass
+class DriftReport:
+    """Сдвиг нового пакета относительно обучающей выборки."""
+    psi: dict  # PSI по каждому исходному столбцу
+    accuracy: float  # точность текущей модели на пакете
+    reference_accuracy: float  # точность на кросс-валидации при полном подборе
+    psi_threshold: float = PSI_THRESHOLD
+    accuracy_drop_threshold: float = ACCURACY_DROP_THRESHOLD
+    trees_added: dict = field(default_factory=dict)  # число новых деревьев по моделям
+
+    @property
+    def max_psi(self):
+        return max(self.psi.values())
+
+    @property
+    def accuracy_drop(self):
+        return self.reference_accuracy - self.accuracy
+
+    @property
+    def needs_full_search(self):
+        return self.max_psi > self.psi_threshold or self.accuracy_drop > self.accuracy_drop_threshold
+
+
+class DriftMonitor:
+    """Запоминает распределения исходных столбцов обучающей выборки и считает PSI для новых пакетов."""
+
+    def __init__(self, bins=DEFAULT_PSI_BINS):
+        self.bins = bins
+
+    def fit(self, data, reference_accuracy):
+        self.reference_ = {}
+        for column in RAW_COLUMNS:
+            values = data[column]
+            if column in CATEGORICAL_COLUMNS:
+                bins = np.sort(values.dropna().unique())
+            else:
+                # Границы интервалов - квантили обучающей выборки
+                quantiles = np.linspace(0, 1, self.bins + 1)[1:-1]
+                bins = np.unique(np.quantile(values.dropna().to_numpy(dtype=np.float64), quantiles))
+            self.reference_[column] = (bins, self._proportions(column, values, bins))
+        self.reference_accuracy_ = float(reference_accuracy)
+        return self
+
+    @staticmethod
+    def _proportions(column, values, bins):
+        # Последние интервалы - пропуски и (для категорий) значения, которых не было при обучении
+        if column in CATEGORICAL_COLUMNS:
+            codes = pd.Categorical(values, categories=bins).codes.astype(np.int64)
+            codes[codes < 0] = len(bins)
+        else:
+            codes = np.searchsorted(bins, values.to_numpy(dtype=np.float64), side='right')
+        codes[values.isna().to_numpy()] = len(bins) + 1
+        return np.bincount(codes, minlength=len(bins) + 2) / max(len(values), 1)
+
+    def psi(self, data):
+        return {
+            column: population_stability_index(expected, self._proportions(column, data[column], bins))
+            for column, (bins, expected) in self.reference_.items()
+        }
+
+    def check(self, data, model, X, y, psi_threshold=PSI_THRESHOLD,
+              accuracy_drop_threshold=ACCURACY_DROP_THRESHOLD):
+        return DriftReport(psi=self.psi(data), accuracy=float(accuracy_score(y, model.predict(X))),
+                           reference_accuracy=self.reference_accuracy_, psi_threshold=psi_threshold,
+                           accuracy_drop_threshold=accuracy_drop_threshold)
+
+
+def _tree_structures(model):
+    if isinstance(model, RandomForestClassifier):
+        return [estimator.tree_ for estimator in model.estimators_]
+    return [estimator.tree_ for estimator in np.ravel(model.estimators_)]
+
+
+def rescale_thresholds(model, old_scaler, new_scaler):
+    """Пересчитывает пороги по масштабированным признакам в обученных деревьях под новый масштаб.
+
+    Стандартизация линейна, поэтому порог t соответствует исходному значению
+    t * old_scale + old_mean, а в новом масштабе - (t * old_scale + old_mean - new_mean) / new_scale.
+
+    Деревья сравнивают значения признаков, приведенные к float32. Для значения,
+    которое отстоит от порога не больше чем на шаг float32 (например, новое
+    значение ровно посередине между двумя значениями из обучающей выборки),
+    решение до пересчета определялось округлением и после пересчета может
+    измениться; остальные строки проходят по деревьям так же, как раньше.
+    """
+    feature_names = list(getattr(model, 'feature_names_in_', FEATURES))
+    for i, column in enumerate(SCALED_COLUMNS):
+        feature = feature_names.index(column)
+        scale = old_scaler.scale_[i] / new_scaler.scale_[i]
+        shift = (old_scaler.mean_[i] - new_scaler.mean_[i]) / new_scaler.scale_[i]
+        for tree in _tree_structures(model):
+            nodes = (tree.children_left != -1) & (tree.feature == feature)
+            tree.threshold[nodes] = tree.threshold[nodes] * scale + shift
+
+
+def add_trees(model, X, y, n_trees):
+    """Добавляет в лес или бустинг `n_trees` деревьев, обученных на (X, y)."""
+    model.set_params(warm_start=True, n_estimators=model.n_estimators + n_trees)
+    return model.fit(X, y)
+
+
+def refit_logistic(model, X, y):
+    """Переобучает логистическую регрессию, начиная с текущих коэффициентов."""
+    model.set_params(warm_start=True)
+    return model.fit(X, y)
+
+
+class IncrementalUpdater:
+    """Дообучает предобработку и модели на новых пакетах, пока сдвиг данных ниже порогов.
+
+    `models` - словарь {имя: обученная модель}; модель `primary` используется для
+    предсказаний и для проверки точности на новом пакете. `history` - исходные
+    размеченные строки, на которых обучены модели. Для логистической регрессии
+    хранятся только последние `history_size` строк: она переобучается на них с
+    warm start от прежних коэффициентов, поэтому состояние и время обновления
+    не растут с числом пакетов. Статистики предобработки и деревья от окна не
+    зависят.
+    """
+
+    def __init__(self, preprocessor, models, monitor, history, primary='gbc',
+                 psi_threshold=PSI_THRESHOLD, accuracy_drop_threshold=ACCURACY_DROP_THRESHOLD,
+                 history_size=DEFAULT_HISTORY_SIZE):
+        self.preprocessor = preprocessor
+        self.models = models
+        self.monitor = monitor
+        self.history_size = history_size
+        self.history = history[RAW_COLUMNS + [TARGET_COLUMN]].tail(history_size).reset_index(drop=True)
+        self.primary = primary
+        self.psi_threshold = psi_threshold
+        self.accuracy_drop_threshold = accuracy_drop_threshold
+
+    @property
+    def model(self):
+        return self.models[self.primary]
+
+    def update(self, batch):
+        """Проверяет сдвиг на новом пакете и, если он ниже порогов, дообучает модели."""
+        batch = batch[RAW_COLUMNS + [TARGET_COLUMN]].reset_index(drop=True)
+        y_new = batch[TARGET_COLUMN]
+        report = self.monitor.check(batch, self.model, preprocess_data(batch, self.preprocessor)[FEATURES], y_new,
+                                    self.psi_threshold, self.accuracy_drop_threshold)
+        if report.needs_full_search:
+            return report
+
+        # Число строк, на которых обучены модели (окно истории может быть меньше)
+        n_seen = int(self.preprocessor.scaler_.n_samples_seen_)
+        old_scaler = copy.deepcopy(self.preprocessor.scaler_)
+        self.preprocessor.partial_fit(batch)
+        self.history = pd.concat([self.history, batch], ignore_index=True).tail(self.history_size)
+        self.history = self.history.reset_index(drop=True)
+        X_new = preprocess_data(batch, self.preprocessor)[FEATURES]
+
+        for name, model in self.models.items():
+            if isinstance(model, LogisticRegression):
+                X_all = preprocess_data(self.history, self.preprocessor)[FEATURES]
+                refit_logistic(model, X_all, self.history[TARGET_COLUMN])
+            elif isinstance(model, (RandomForestClassifier, GradientBoostingClassifier)):
+                # Старые деревья обучены в прежнем масштабе Age и Fare
+                rescale_thresholds(model, old_scaler, self.preprocessor.scaler_)
+                # Деревья обучаются на пакете, только если в нем есть все классы
+                if set(np.unique(y_new)) != set(model.classes_):
+                    report.trees_added[name] = 0
+                    continue
+                n_trees = max(1, round(model.n_estimators * len(batch) / n_seen))
+                add_trees(model, X_new, y_new, n_trees)
+                report.trees_added[name] = n_trees
+        return report
+
+    def save(self, path=DEFAULT_STATE_PATH):
+        joblib.dump(self, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_STATE_PATH):
+        return joblib.load(path)
+
+
+def print_report(report):
+    print(f'{"Столбец":<12}{"PSI":>8}')
+    for column, value in report.psi.items():
+        print(f'{column:<12}{value:>8.3f}')
+    print(f'Точность на пакете: {report.accuracy:.4f} (при подборе: {report.reference_accuracy:.4f})')
+    if report.needs_full_search:
+        print('Сдвиг данных выше порогов: модели не изменены, нужен полный подбор гиперпараметров (титаник.py)')
+    else:
+        print(f'Модели дообучены, добавлено деревьев: {report.trees_added}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Дообучение моделей на новом пакете размеченных пассажиров')
+    parser.add_argument('input', help='CSV с новыми пассажирами в формате train.csv (со столбцом Survived)')
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH, help='состояние дообучения (сохраняет титаник.py)')
+    parser.add_argument('--model', default='model.joblib', help='куда сохранить основную модель (joblib)')
+    parser.add_argument('--preprocessor', default='preprocessor.joblib', help='куда сохранить предобработку (joblib)')
+    parser.add_argument('--compiled', default='model.npz',
+                        help='куда экспортировать основную модель (.npz); пустая строка - не экспортировать')
+    parser.add_argument('--compiled-rf', default='model_rf.npz',
+                        help='куда экспортировать случайный лес (.npz); пустая строка - не экспортировать')
+    parser.add_argument('--psi-threshold', type=float, default=PSI_THRESHOLD)
+    parser.add_argument('--accuracy-drop-threshold', type=float, default=ACCURACY_DROP_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    updater = IncrementalUpdater.load(args.state)
+    updater.psi_threshold = args.psi_threshold
+    updater.accuracy_drop_threshold = args.accuracy_drop_threshold
+    report = updater.update(pd.read_csv(args.input))
+    print_report(report)
+    if report.needs_full_search:
+        return 1
+
+    # Модели, обученные в прежнем масштабе, не должны остаться рядом с новой предобработкой
+    preprocessor = updater.preprocessor
+    preprocessor.save(args.preprocessor)
+    save_model(updater.model, args.model, preprocessor)
+    if args.compiled:
+        save_model(updater.model, args.compiled, preprocessor)
+    if args.compiled_rf and 'rf' in updater.models:
+        save_model(updater.models['rf'], args.compiled_rf, preprocessor)
+    updater.save(args.state)
+    print('Стекинг (model_stacking.joblib) не дообучается: для него перезапустите титаник.py')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Обучаемая предобработка данных пассажиров Титаника.
+
+Все статистики (медианы, мода, параметры масштабирования) вычисляются один раз
+на обучающей выборке в `fit`, после чего `transform` применяет их к любым новым
+данным без переобучения одним векторизованным проходом.
+
+`partial_fit` дообучает статистики на новом пакете размеченных строк без
+обращения к уже обработанным: медианы и мода пересчитываются по накопленным
+частотам значений, среднее и дисперсия для масштабирования - по потоковым
+моментам StandardScaler.
+"""
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.preprocessing import StandardScaler
+
+from cache import make_key
+
+# Признаки, на которых обучаются модели
+FEATURES = ['Sex', 'Age', 'Fare', 'Family_Size', 'Is_Alone', 'Pclass_2', 'Pclass_3', 'Embarked_Q', 'Embarked_S']
+
+# Узкие типы признаков для компактного хранения (см. dataset.py)
+FEATURE_DTYPES = {
+    'Sex': np.uint8,
+    'Age': np.float32,
+    'Fare': np.float32,
+    'Family_Size': np.uint8,
+    'Is_Alone': np.uint8,
+    'Pclass_2': np.uint8,
+    'Pclass_3': np.uint8,
+    'Embarked_Q': np.uint8,
+    'Embarked_S': np.uint8,
+}
+
+# Столбцы исходных данных, которые нужны для построения признаков
+RAW_COLUMNS = ['Sex', 'Age', 'Fare', 'SibSp', 'Parch', 'Pclass', 'Embarked']
+
+SEX_MAP = {'male': 0, 'female': 1}
+
+# Числовые признаки, которые масштабируются
+SCALED_COLUMNS = ['Age', 'Fare']
+
+
+class TitanicPreprocessor(BaseEstimator, TransformerMixin):
+    """Преобразует сырые данные в матрицу признаков `FEATURES`.
+
+    Пол кодируется числом, пропуски в Age/Fare заполняются медианами, а в
+    Embarked - модой обучающей выборки. Создаются признаки Family_Size и
+    Is_Alone, Embarked и Pclass кодируются one-hot с фиксированным набором
+    категорий (первая категория отбрасывается), Age и Fare стандартизуются.
+    """
+
+    def fit(self, data, y=None):
+        for attr in ('age_counts_', 'fare_counts_', 'embarked_counts_', 'scaler_'):
+            self.__dict__.pop(attr, None)
+        return self.partial_fit(data)
+
+    def partial_fit(self, data, y=None):
+        """Обновляет статистики по новому пакету строк (первый вызов равносилен `fit`)."""
+        if not hasattr(self, 'scaler_'):
+            empty = pd.Series(dtype=np.int64)
+            self.age_counts_, self.fare_counts_, self.embarked_counts_ = empty, empty, empty
+            self.scaler_ = StandardScaler()
+
+        # Частоты значений: по ним медиана и мода совпадают с посчитанными по всем строкам сразу
+        self.age_counts_ = _add_counts(self.age_counts_, data['Age'])
+        self.fare_counts_ = _add_counts(self.fare_counts_, data['Fare'])
+        self.embarked_counts_ = _add_counts(self.embarked_counts_, data['Embarked'])
+        self.age_median_ = _median_from_counts(self.age_counts_)
+        self.fare_median_ = _median_from_counts(self.fare_counts_)
+        # Как и Series.mode(), при равных частотах берем наименьшее значение
+        self.embarked_mode_ = self.embarked_counts_.idxmax()
+
+        # Масштаб считаем по уже заполненным значениям, как и при обучении моделей
+        self.scaler_.partial_fit(self._impute(data)[SCALED_COLUMNS].to_numpy())
+        return self
+
+    def _impute(self, data):
+        return pd.DataFrame({
+            'Age': data['Age'].fillna(self.age_median_).astype(np.float64),
+            'Fare': data['Fare'].fillna(self.fare_median_).astype(np.float64),
+            'Embarked': data['Embarked'].fillna(self.embarked_mode_),
+        }, index=data.index)
+
+    def transform(self, data):
+        imputed = self._impute(data)
+        scaled = self.scaler_.transform(imputed[SCALED_COLUMNS].to_numpy())
+
+        family_size = data['SibSp'] + data['Parch'] + 1
+        pclass = data['Pclass']
+        embarked = imputed['Embarked']
+
+        return pd.DataFrame({
+            'Sex': data['Sex'].map(SEX_MAP),
+            'Age': scaled[:, 0],
+            'Fare': scaled[:, 1],
+            'Family_Size': family_size,
+            'Is_Alone': (family_size == 1).astype(np.int64),
+            'Pclass_2': (pclass == 2).astype(np.uint8),
+            'Pclass_3': (pclass == 3).astype(np.uint8),
+            'Embarked_Q': (embarked == 'Q').astype(np.uint8),
+            'Embarked_S': (embarked == 'S').astype(np.uint8),
+        }, index=data.index)
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(FEATURES, dtype=object)
+
+    def fingerprint(self):
+        """Хэш статистик предобработки; модель сохраняется вместе с ним (см. score.save_model)."""
+        return make_key(self.age_median_, self.fare_median_, self.embarked_mode_,
+                        self.scaler_.mean_, self.scaler_.scale_)
+
+    def save(self, path):
+        joblib.dump(self, path)
+
+    @classmethod
+    def load(cls, path):
+        return joblib.load(path)
+
+
+def _add_counts(counts, values):
+    """Добавляет частоты непропущенных значений к накопленным, индекс отсортирован."""
+    return counts.add(values.value_counts(), fill_value=0).astype(np.int64).sort_index()
+
+
+def _median_from_counts(counts):
+    """Медиана по частотам значений, как Series.median() по исходным строкам."""
+    if counts.empty:
+        return float('nan')
+    cumulative = counts.to_numpy().cumsum()
+    n = cumulative[-1]
+    values = counts.index.to_numpy(dtype=np.float64)
+    lower = values[np.searchsorted(cumulative, (n - 1) // 2, side='right')]
+    upper = values[np.searchsorted(cumulative, n // 2, side='right')]
+    return float(np.mean([lower, upper]))
+
+
+def preprocess_data(data, preprocessor):
+    """Строит матрицу признаков для новых данных обученным `preprocessor`."""
+    return preprocessor.transform(data)
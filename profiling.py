@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""Замеры времени и памяти по этапам пайплайна.
+
+Для каждого этапа записываются время выполнения (wall time), процессорное
+время, пиковый объем занятой памяти процесса (peak RSS) и число обработанных
+строк.
+
+Подбор гиперпараметров, кросс-валидация и стекинг работают в процессах
+joblib (loky), которые не видны в `time.process_time` и `RUSAGE_SELF`. Поэтому
+во время этапа фоновый поток раз в `sample_interval` секунд опрашивает через
+/proc все дочерние процессы: `cpu_time` - процессорное время основного процесса
+и воркеров за этап, `stage_rss_mb` - наибольший суммарный RSS основного
+процесса и воркеров за этап (пик между опросами может быть пропущен). Без
+/proc (Windows, macOS) эти поля считаются только по основному процессу, а
+`workers_tracked` равно False. Для этапов подбора гиперпараметров можно добавить время обучения
+каждой комбинации. Отчет сохраняется в JSON, чтобы сравнивать запуски между
+собой и замечать регрессии.
+
+Пиковый RSS процесса только растет, поэтому по нему нельзя сравнить два этапа,
+идущих друг за другом. С `trace_memory=True` для каждого этапа дополнительно
+записывается пик памяти, выделенной за время этапа (tracemalloc; учитывает
+массивы NumPy и SciPy, но не внутренние буферы расширений на C). Трассировка
+включается в начале этапа и выключается в конце, остальной код она не замедляет.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """Пиковый объем памяти процесса в МБ (None, если недоступен)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux ru_maxrss в килобайтах, в macOS - в байтах
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+DEFAULT_SAMPLE_INTERVAL = 0.1  # секунды
+
+_PROC = '/proc'
+
+
+def _proc_stat(pid):
+    """(ppid, процессорное время в секундах, RSS в байтах) процесса из /proc/<pid>/stat."""
+    with open(os.path.join(_PROC, str(pid), 'stat')) as f:
+        # Имя процесса в скобках может содержать пробелы, поля считаем после него
+        fields = f.read().rpartition(')')[2].split()
+    ticks = os.sysconf('SC_CLK_TCK')
+    return int(fields[1]), (int(fields[11]) + int(fields[12])) / ticks, int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _descendants(pid):
+    """Процессорное время и RSS всех потомков процесса `pid` (воркеров joblib и их детей)."""
+    stats = {}
+    for name in os.listdir(_PROC):
+        if name.isdigit():
+            try:
+                stats[int(name)] = _proc_stat(name)
+            except (OSError, IndexError, ValueError):
+                continue  # процесс уже завершился
+    children = {}
+    for child, (ppid, _, _) in stats.items():
+        children.setdefault(ppid, []).append(child)
+    result, stack = {}, list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        result[child] = stats[child][1:]
+        stack.extend(children.get(child, []))
+    return result
+
+
+class _WorkerSampler:
+    """Фоновый опрос дочерних процессов: их процессорное время и наибольший суммарный RSS за этап."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pid = os.getpid()
+        self._start_cpu = {pid: cpu for pid, (cpu, _) in _descendants(self._pid).items()}
+        # Последнее увиденное время процесса: воркер может завершиться до конца этапа
+        self._last_cpu = dict(self._start_cpu)
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        children = _descendants(self._pid)
+        for pid, (cpu, _) in children.items():
+            self._last_cpu[pid] = cpu
+        try:
+            own_rss = _proc_stat(self._pid)[2]
+        except OSError:
+            own_rss = 0
+        self.peak_rss = max(self.peak_rss, own_rss + sum(rss for _, rss in children.values()))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        """Останавливает опрос; возвращает процессорное время воркеров за этап (с) и пик RSS (МБ)."""
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        cpu = sum(last - self._start_cpu.get(pid, 0.0) for pid, last in self._last_cpu.items())
+        return cpu, self.peak_rss / (1024 * 1024)
+
+
+class StageProfiler:
+    """Собирает замеры по этапам: `with profiler.stage('name', rows=n): ...`.
+
+    В скрипте-ноутбуке, где этап занимает несколько ячеек, удобнее пара
+    `profiler.start('name')` / `profiler.stop(rows=n)`.
+    """
+
+    def __init__(self, trace_memory=False, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        self.trace_memory = trace_memory
+        self.sample_interval = sample_interval
+        # Воркеры можно опросить только через /proc (Linux)
+        self.workers_tracked = os.path.isdir(os.path.join(_PROC, 'self'))
+        self.stages = []
+        self._current = None
+        self._created = time.time()
+
+    def start(self, name):
+        if self._current is not None:
+            self.stop()
+        self._current = {
+            'name': name,
+            'wall': time.perf_counter(),
+            'cpu': time.process_time(),
+            'peak_rss_before_mb': peak_rss_mb(),
+        }
+        if self.workers_tracked:
+            self._current['sampler'] = _WorkerSampler(self.sample_interval)
+        if self.trace_memory:
+            # Трассировка включается только на время этапа, если ее не включил кто-то другой
+            self._current['started_tracing'] = not tracemalloc.is_tracing()
+            if self._current['started_tracing']:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._current['traced_before'] = tracemalloc.get_traced_memory()[0]
+
+    def stop(self, rows=None):
+        current, self._current = self._current, None
+        if current is None:
+            return None
+        parent_cpu = time.process_time() - current['cpu']
+        record = {
+            'stage': current['name'],
+            'wall_time': time.perf_counter() - current['wall'],
+            'cpu_time': parent_cpu,
+            'parent_cpu_time': parent_cpu,
+            'workers_cpu_time': None,
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_before_mb': current['peak_rss_before_mb'],
+            'stage_rss_mb': None,
+            'workers_tracked': 'sampler' in current,
+            'rows': rows,
+        }
+        if 'sampler' in current:
+            workers_cpu, stage_rss = current['sampler'].stop()
+            record.update(cpu_time=parent_cpu + workers_cpu, workers_cpu_time=workers_cpu, stage_rss_mb=stage_rss)
+        if 'traced_before' in current:
+            # Пик сверх памяти, занятой к началу этапа
+            record['traced_peak_mb'] = (tracemalloc.get_traced_memory()[1] - current['traced_before']) / (1024 * 1024)
+            if current['started_tracing']:
+                tracemalloc.stop()
+        self.stages.append(record)
+        return record
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(rows)
+
+    def set_rows(self, rows, stage=None):
+        """Задает число строк для последнего (или названного) завершенного этапа."""
+        for record in reversed(self.stages):
+            if stage is None or record['stage'] == stage:
+                record['rows'] = rows
+                return
+
+    def record_fits(self, stage, search):
+        """Добавляет к этапу время обучения каждой комбинации из `search.cv_results_`."""
+        results = search.cv_results_
+        fits = []
+        for i, params in enumerate(results['params']):
+            fit = {'params': {key: value for key, value in params.items()},
+                   'mean_fit_time': float(results['mean_fit_time'][i])}
+            if 'std_fit_time' in results:
+                fit['std_fit_time'] = float(results['std_fit_time'][i])
+            fits.append(fit)
+        for record in reversed(self.stages):
+            if record['stage'] == stage:
+                record['fits'] = fits
+                return
+
+    def report(self):
+        return {
+            'created': self._created,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pid': os.getpid(),
+            'total_wall_time': sum(record['wall_time'] for record in self.stages),
+            'stages': self.stages,
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False, default=str)
+
+    def print_summary(self):
+        total = sum(record['wall_time'] for record in self.stages) or 1.0
+        traced = any('traced_peak_mb' in record for record in self.stages)
+        print(f'{"Этап":<24}{"Время, с":>10}{"CPU, с":>10}{"Доля":>8}{"Пик RSS, МБ":>14}{"RSS этапа, МБ":>15}'
+              f'{"Строк":>10}' + (f'{"Пик этапа, МБ":>16}' if traced else ''))
+        for record in self.stages:
+            rss = record['peak_rss_mb']
+            stage_rss = record.get('stage_rss_mb')
+            line = (f'{record["stage"]:<24}{record["wall_time"]:>10.2f}{record["cpu_time"]:>10.2f}'
+                    f'{record["wall_time"] / total:>8.1%}{(f"{rss:.0f}" if rss is not None else "-"):>14}'
+                    f'{(f"{stage_rss:.0f}" if stage_rss is not None else "-"):>15}'
+                    f'{(record["rows"] if record["rows"] is not None else "-"):>10}')
+            if traced:
+                peak = record.get('traced_peak_mb')
+                line += f'{(f"{peak:.1f}" if peak is not None else "-"):>16}'
+            print(line)
+        if self.stages and not all(record.get('workers_tracked') for record in self.stages):
+            print('CPU и RSS без процессов-воркеров: /proc недоступен, учтен только основной процесс')
+        else:
+            print('CPU - основной процесс и воркеры; Пик RSS - основной процесс за все время; '
+                  'RSS этапа - основной процесс и воркеры во время этапа')
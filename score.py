@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Пакетное предсказание выживаемости для больших CSV-файлов с пассажирами.
+
+Входной файл читается блоками фиксированного размера, каждый блок проходит
+через обученную предобработку и модель, а результаты сразу дописываются в
+выходной файл. Поэтому расход памяти не зависит от размера входного файла.
+
+Пример запуска:
+
+    python score.py passengers.csv submission.csv --chunksize 100000
+
+С параметром `--n-jobs` блоки распределяются по пулу процессов, а порядок
+строк в выходном файле совпадает с порядком во входном. Модель загружается
+один раз в основном процессе, и процессы пула создаются через fork: страницы
+с массивами деревьев у всех процессов общие (копирование при записи), и
+предсказание их не меняет. Там, где fork недоступен (Windows), каждый процесс
+получает свою копию модели.
+
+Модель может быть сохранена в joblib или экспортирована в `.npz` для быстрого
+предсказания без sklearn (см. compiled_trees.py); формат определяется по
+расширению файла.
+
+Вместо CSV можно передать каталог с уже подготовленными признаками
+(см. dataset.py): тогда блоки берутся из отображенных в память столбцов
+без разбора текста и без предобработки, а отпечаток предобработки из
+`meta.json` сверяется с отпечатком модели.
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import pandas as pd
+
+from dataset import load_feature_matrix, load_meta
+from preprocessing import FEATURES, RAW_COLUMNS, TitanicPreprocessor, preprocess_data
+
+DEFAULT_MODEL_PATH = 'model.joblib'
+DEFAULT_PREPROCESSOR_PATH = 'preprocessor.joblib'
+DEFAULT_CHUNKSIZE = 100_000
+
+ID_COLUMN = 'PassengerId'
+
+
+def load_model(model_path):
+    """Загружает модель: `.npz` - экспортированный ансамбль деревьев, иначе joblib."""
+    if model_path.endswith('.npz'):
+        from compiled_trees import CompiledEnsemble
+
+        return CompiledEnsemble.load(model_path)
+    return joblib.load(model_path)
+
+
+def save_model(model, path, preprocessor):
+    """Сохраняет модель с отпечатком предобработки `preprocessor`: `.npz` - экспорт ансамбля деревьев, иначе joblib."""
+    if path.endswith('.npz'):
+        from compiled_trees import CompiledEnsemble, export_ensemble
+
+        model = model if isinstance(model, CompiledEnsemble) else export_ensemble(model)
+        model.preprocessor_fingerprint_ = preprocessor.fingerprint()
+        model.save(path)
+        return model
+    model.preprocessor_fingerprint_ = preprocessor.fingerprint()
+    joblib.dump(model, path)
+    return model
+
+
+def check_preprocessor(model, preprocessor):
+    """Проверяет, что модель обучена с этой предобработкой.
+
+    Модель, сохраненная до появления отпечатков (без `preprocessor_fingerprint_`), не проверяется.
+    """
+    fingerprint = getattr(model, 'preprocessor_fingerprint_', None)
+    if fingerprint is not None and fingerprint != preprocessor.fingerprint():
+        raise ValueError('Модель обучена с другой предобработкой: сохраните модель заново вместе с '
+                         'текущей предобработкой (титаник.py или incremental.py)')
+
+
+def check_dataset(model, dataset_path):
+    """Проверяет, что признаки в каталоге `dataset_path` получены той же предобработкой, что у модели."""
+    fingerprint = getattr(model, 'preprocessor_fingerprint_', None)
+    if fingerprint is not None and load_meta(dataset_path).get('preprocessor_fingerprint') != fingerprint:
+        raise ValueError(f'Признаки в {dataset_path} получены другой предобработкой, чем у модели (или '
+                         'сохранены без ее отпечатка): подготовьте их заново через dataset.py')
+
+
+def load_artifacts(model_path=DEFAULT_MODEL_PATH, preprocessor_path=DEFAULT_PREPROCESSOR_PATH):
+    """Загружает сохраненные модель и предобработку и проверяет, что они совместимы."""
+    model = load_model(model_path)
+    preprocessor = TitanicPreprocessor.load(preprocessor_path)
+    check_preprocessor(model, preprocessor)
+    return model, preprocessor
+
+
+def read_chunks(input_path, chunksize=DEFAULT_CHUNKSIZE):
+    """Читает из CSV только нужные для предсказания столбцы блоками по `chunksize` строк."""
+    return pd.read_csv(input_path, usecols=[ID_COLUMN] + RAW_COLUMNS, chunksize=chunksize)
+
+
+def read_feature_chunks(dataset_path, chunksize=DEFAULT_CHUNKSIZE):
+    """Отдает блоки уже подготовленных признаков из колоночного набора данных."""
+    X, _, ids = load_feature_matrix(dataset_path, mmap=True)
+    for start in range(0, len(X), chunksize):
+        chunk = X.iloc[start:start + chunksize]
+        yield chunk.assign(**{ID_COLUMN: ids.iloc[start:start + chunksize].to_numpy()})
+
+
+def score_chunk(chunk, model, preprocessor):
+    """Предсказывает выживаемость для одного блока данных.
+
+    Если `preprocessor` равен None, блок уже содержит готовые признаки.
+    """
+    X = chunk[FEATURES] if preprocessor is None else preprocess_data(chunk, preprocessor)[FEATURES]
+    return pd.DataFrame({ID_COLUMN: chunk[ID_COLUMN].to_numpy(), 'Survived': model.predict(X)})
+
+
+def score_chunks(chunks, model, preprocessor):
+    """Последовательно предсказывает выживаемость для каждого блока."""
+    for chunk in chunks:
+        yield score_chunk(chunk, model, preprocessor)
+
+
+# Модель и предобработка для процессов-обработчиков
+_worker_model = None
+_worker_preprocessor = None
+
+
+def _init_worker(model, preprocessor):
+    global _worker_model, _worker_preprocessor
+    _worker_model, _worker_preprocessor = model, preprocessor
+
+
+def _score_chunk_in_worker(chunk):
+    return score_chunk(chunk, _worker_model, _worker_preprocessor)
+
+
+def score_chunks_parallel(chunks, model, preprocessor, n_jobs):
+    """Предсказывает выживаемость для блоков в пуле из `n_jobs` процессов.
+
+    Результаты возвращаются в порядке входных блоков. Одновременно в работе
+    находится не больше 2 * n_jobs блоков, поэтому расход памяти ограничен.
+    """
+    max_pending = 2 * n_jobs
+    if 'fork' in multiprocessing.get_all_start_methods():
+        # Процессы наследуют уже загруженную модель: массивы деревьев не копируются и не пересылаются
+        _init_worker(model, preprocessor)
+        pool = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('fork'))
+    else:
+        pool = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(model, preprocessor))
+    try:
+        with pool as executor:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_score_chunk_in_worker, chunk))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        _init_worker(None, None)
+
+
+def write_results(results, output_path):
+    """Дописывает результаты в CSV по мере поступления, возвращает число строк."""
+    n_rows = 0
+    with open(output_path, 'w', newline='') as f:
+        for i, result in enumerate(results):
+            result.to_csv(f, index=False, header=(i == 0))
+            n_rows += len(result)
+    return n_rows
+
+
+def score_file(input_path, output_path, model_path=DEFAULT_MODEL_PATH,
+               preprocessor_path=DEFAULT_PREPROCESSOR_PATH, chunksize=DEFAULT_CHUNKSIZE, n_jobs=1):
+    """Предсказывает выживаемость для всего файла, возвращает число строк и скорость (строк/с)."""
+    start = time.perf_counter()
+    if os.path.isdir(input_path):
+        # Признаки уже подготовлены, предобработка не нужна
+        chunks = read_feature_chunks(input_path, chunksize)
+        preprocessor_path = None
+    else:
+        chunks = read_chunks(input_path, chunksize)
+    if preprocessor_path:
+        model, preprocessor = load_artifacts(model_path, preprocessor_path)
+    else:
+        model, preprocessor = load_model(model_path), None
+        check_dataset(model, input_path)
+    if n_jobs > 1:
+        results = score_chunks_parallel(chunks, model, preprocessor, n_jobs)
+    else:
+        results = score_chunks(chunks, model, preprocessor)
+    n_rows = write_results(results, output_path)
+    elapsed = time.perf_counter() - start
+    return n_rows, n_rows / elapsed if elapsed > 0 else float('inf')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пакетное предсказание выживаемости пассажиров Титаника')
+    parser.add_argument('input', help='CSV-файл с пассажирами в формате test.csv или каталог с признаками')
+    parser.add_argument('output', nargs='?', default='submission.csv', help='CSV-файл для результатов')
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help='сохраненная модель (joblib или .npz)')
+    parser.add_argument('--preprocessor', default=DEFAULT_PREPROCESSOR_PATH, help='сохраненная предобработка (joblib)')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='размер блока в строках')
+    parser.add_argument('--n-jobs', type=int, default=1, help='число процессов для обработки блоков')
+    args = parser.parse_args(argv)
+
+    n_rows, rows_per_sec = score_file(args.input, args.output, args.model, args.preprocessor,
+                                      args.chunksize, args.n_jobs)
+    print(f'Обработано строк: {n_rows}, скорость: {rows_per_sec:.0f} строк/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""Онлайн-сервис предсказания выживаемости для отдельных пассажиров.
+
+Сервис один раз загружает обученную предобработку и модель и отвечает по HTTP:
+
+    POST /predict  - пассажир (или список пассажиров) в формате train.csv,
+                     ответ {"survival_probability": ...}
+    GET  /stats    - задержка p50/p99 и пропускная способность
+    GET  /health   - проверка работоспособности
+
+Одновременные запросы собираются в мини-пакеты: пакет закрывается, когда в нем
+набралось `max_batch_size` пассажиров или прошло `max_delay` секунд с первого
+запроса, и предсказывается одним векторизованным вызовом `predict_proba`.
+
+Пример запуска:
+
+    python server.py --port 8000
+    curl -d '{"Pclass": 3, "Sex": "male", "Age": 22, "SibSp": 1, "Parch": 0, "Fare": 7.25, "Embarked": "S"}' \\
+        http://127.0.0.1:8000/predict
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import FEATURES, RAW_COLUMNS, SEX_MAP, preprocess_data
+from score import load_artifacts
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_DELAY = 0.002  # секунды
+
+# Столбцы, без которых признаки не построить (Age, Fare и Embarked заполняются медианами/модой)
+REQUIRED_COLUMNS = ['Pclass', 'Sex', 'SibSp', 'Parch']
+
+EMBARKED_PORTS = ('C', 'Q', 'S')
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def _number(passenger, column, required=False, integer=False):
+    """Приводит поле к числу (целому для счетчиков и класса) или отклоняет его."""
+    value = passenger.get(column)
+    if value is None:
+        if required:
+            raise ValueError(f'Не задано поле: {column}')
+        return None
+    # bool - подкласс int, но True в качестве возраста или класса - ошибка клиента
+    if isinstance(value, bool):
+        raise ValueError(f'{column} должно быть числом')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{column} должно быть числом') from None
+    if not np.isfinite(number) or number < 0:
+        raise ValueError(f'{column} должно быть неотрицательным конечным числом')
+    if integer:
+        if not number.is_integer():
+            raise ValueError(f'{column} должно быть целым числом')
+        return int(number)
+    return number
+
+
+def validate_passenger(passenger):
+    """Проверяет и приводит к нужным типам поля пассажира, оставляя только нужные для предсказания.
+
+    Ошибка в данных одного пассажира отклоняет его запрос до постановки в
+    очередь и не затрагивает других клиентов в том же мини-пакете.
+    """
+    if not isinstance(passenger, dict):
+        raise ValueError('Пассажир должен быть JSON-объектом')
+    missing = [column for column in REQUIRED_COLUMNS if passenger.get(column) is None]
+    if missing:
+        raise ValueError(f'Не заданы поля: {", ".join(missing)}')
+    if passenger['Sex'] not in SEX_MAP:
+        raise ValueError(f'Sex должен быть одним из: {", ".join(SEX_MAP)}')
+    pclass = _number(passenger, 'Pclass', required=True, integer=True)
+    if pclass not in (1, 2, 3):
+        raise ValueError('Pclass должен быть 1, 2 или 3')
+    embarked = passenger.get('Embarked')
+    if embarked is not None and embarked not in EMBARKED_PORTS:
+        raise ValueError(f'Embarked должен быть одним из: {", ".join(EMBARKED_PORTS)}')
+    return {
+        'Sex': passenger['Sex'],
+        'Age': _number(passenger, 'Age'),
+        'Fare': _number(passenger, 'Fare'),
+        'SibSp': _number(passenger, 'SibSp', required=True, integer=True),
+        'Parch': _number(passenger, 'Parch', required=True, integer=True),
+        'Pclass': pclass,
+        'Embarked': embarked,
+    }
+
+
+class LatencyStats:
+    """Счетчики задержки и пропускной способности по последним `window` запросам."""
+
+    def __init__(self, window=10_000):
+        self.latencies = collections.deque(maxlen=window)
+        self.finished = collections.deque(maxlen=window)
+        self.started = time.monotonic()
+        self.requests = 0
+        self.passengers = 0
+        self.batches = 0
+        self.batched_passengers = 0
+
+    def record_request(self, latency, n_passengers):
+        self.latencies.append(latency)
+        self.finished.append(time.monotonic())
+        self.requests += 1
+        self.passengers += n_passengers
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batched_passengers += size
+
+    def snapshot(self):
+        latencies = np.asarray(self.latencies)
+        now = time.monotonic()
+        recent = sum(1 for t in self.finished if now - t <= 60)
+        return {
+            'requests': self.requests,
+            'passengers': self.passengers,
+            'uptime_sec': now - self.started,
+            'throughput_rps': self.requests / max(now - self.started, 1e-9),
+            'recent_rps_60s': recent / min(60.0, max(now - self.started, 1e-9)),
+            'latency_p50_ms': float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+            'latency_p99_ms': float(np.percentile(latencies, 99) * 1000) if len(latencies) else None,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_passengers / self.batches if self.batches else None,
+        }
+
+
+class MicroBatcher:
+    """Собирает пассажиров из одновременных запросов в пакеты для `predict_proba`."""
+
+    def __init__(self, model, preprocessor, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY,
+                 stats=None):
+        self.model = model
+        self.preprocessor = preprocessor
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.stats = stats
+        self.queue = asyncio.Queue()
+        # Предсказание выполняется в отдельном потоке, чтобы цикл событий продолжал принимать запросы
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def predict_batch(self, passengers):
+        data = pd.DataFrame.from_records(passengers, columns=RAW_COLUMNS)
+        data = data.astype({'Age': float, 'Fare': float, 'SibSp': int, 'Parch': int, 'Pclass': int})
+        X = preprocess_data(data, self.preprocessor)[FEATURES]
+        return self.model.predict_proba(X)[:, 1]
+
+    async def predict(self, passengers):
+        """Возвращает вероятности выживания для списка проверенных пассажиров."""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for passenger in passengers:
+            future = loop.create_future()
+            self.queue.put_nowait((passenger, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Все, что уже стоит в очереди, тоже забираем в пакет без ожидания
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            passengers = [passenger for passenger, _ in batch]
+            try:
+                probabilities = await loop.run_in_executor(self._executor, self.predict_batch, passengers)
+            except Exception:
+                # Ошибка пакета не должна доставаться всем клиентам: повторяем по одному пассажиру
+                await self._predict_each(batch)
+                continue
+            if self.stats is not None:
+                self.stats.record_batch(len(batch))
+            for (_, future), probability in zip(batch, probabilities):
+                if not future.done():
+                    future.set_result(float(probability))
+
+    async def _predict_each(self, batch):
+        loop = asyncio.get_running_loop()
+        for passenger, future in batch:
+            try:
+                probability = await loop.run_in_executor(self._executor, self.predict_batch, [passenger])
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+                continue
+            if self.stats is not None:
+                self.stats.record_batch(1)
+            if not future.done():
+                future.set_result(float(probability[0]))
+
+
+class PredictionServer:
+    """HTTP/1.1 сервер на asyncio с поддержкой keep-alive."""
+
+    def __init__(self, model, preprocessor, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY):
+        self.stats = LatencyStats()
+        self.batcher = MicroBatcher(model, preprocessor, max_batch_size, max_delay, self.stats)
+
+    async def handle_predict(self, body):
+        start = time.perf_counter()
+        payload = json.loads(body)
+        single = isinstance(payload, dict)
+        passengers = [validate_passenger(passenger) for passenger in ([payload] if single else payload)]
+        probabilities = await self.batcher.predict(passengers)
+        self.stats.record_request(time.perf_counter() - start, len(passengers))
+        if single:
+            return {'survival_probability': probabilities[0]}
+        return {'survival_probability': probabilities}
+
+    async def dispatch(self, method, path, body):
+        if path == '/predict':
+            if method != 'POST':
+                return 405, {'error': 'Используйте POST'}
+            try:
+                return 200, await self.handle_predict(body)
+            except (ValueError, TypeError) as exc:
+                return 400, {'error': str(exc)}
+        if path == '/stats' and method == 'GET':
+            return 200, self.stats.snapshot()
+        if path == '/health' and method == 'GET':
+            return 200, {'status': 'ok'}
+        return 404, {'error': 'Не найдено'}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Некорректный запрос'}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0) or 0)
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                try:
+                    status, payload = await self.dispatch(method, target.split('?', 1)[0], body)
+                except Exception as exc:
+                    status, payload = 500, {'error': str(exc)}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+                f'Content-Type: application/json; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        batcher_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f'Сервис предсказаний запущен на http://{host}:{port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Онлайн-сервис предсказания выживаемости пассажиров Титаника')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--model', default='model.joblib', help='сохраненная модель (joblib или .npz)')
+    parser.add_argument('--preprocessor', default='preprocessor.joblib', help='сохраненная предобработка (joblib)')
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help='максимальный размер мини-пакета')
+    parser.add_argument('--max-delay-ms', type=float, default=DEFAULT_MAX_DELAY * 1000,
+                        help='максимальное ожидание для набора мини-пакета, мс')
+    args = parser.parse_args(argv)
+
+    model, preprocessor = load_artifacts(args.model, args.preprocessor)
+    server = PredictionServer(model, preprocessor, args.max_batch_size, args.max_delay_ms / 1000)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
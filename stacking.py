@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Стекинг: метамодель поверх вероятностей выживания от базовых моделей.
+
+`StackingClassifier` из sklearn при каждом обучении заново обучает все
+базовые модели на каждом фолде, даже если меняется только метамодель. Здесь
+вероятности вне фолда (`fit_base_models`) считаются один раз: все модели и
+фолды, а также обучение базовых моделей на всех данных, - одним параллельным
+проходом. С параметром `cache` (`cache.FoldCache`) результаты на фолдах
+хранятся в тех же записях, что и у `evaluation.evaluate_cv`, поэтому уже
+оцененные кросс-валидацией модели повторно не обучаются.
+
+После этого метамодель заменяется (`StackedClassifier.fit_final`) или
+подбирается по сетке (`tune_final`) за секунды: она обучается только на
+таблице вероятностей, а базовые модели не трогаются.
+"""
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import GridSearchCV, check_cv
+
+from cache import data_key, fold_key
+from evaluation import _fit_fold, _take
+
+# Номер "фолда" для обучения базовой модели на всех данных
+FULL_FIT = 'full'
+
+
+def _fit_full(estimator, X, y):
+    return {'model': clone(estimator).fit(X, y)}
+
+
+def fit_base_models(estimators, X, y, cv=5, n_jobs=-1, cache=None):
+    """Вероятности вне фолда и базовые модели, обученные на всех данных.
+
+    `estimators` - словарь {имя: модель}. Возвращает DataFrame вероятностей
+    класса 1 (столбец на модель, строки в порядке X) и словарь обученных на
+    всех данных моделей. Фолды те же, что у `evaluate_cv` с тем же `cv`.
+    """
+    cv = check_cv(cv, y, classifier=True)
+    splits = list(cv.split(X, y))
+    tasks = [(name, fold) for name in estimators for fold in [*range(len(splits)), FULL_FIT]]
+    results = dict.fromkeys(tasks)
+    if cache is not None:
+        data_hash = data_key(X, y)
+        keys = {
+            (name, fold): fold_key(data_hash, estimators[name], {}, fold,
+                                   np.arange(len(y)) if fold == FULL_FIT else splits[fold][1])
+            for name, fold in tasks
+        }
+        results = {task: cache.get(key) for task, key in keys.items()}
+
+    missing = [task for task, result in results.items() if result is None]
+    fitted = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_full)(estimators[name], X, y) if fold == FULL_FIT
+        else delayed(_fit_fold)(estimators[name], X, y, *splits[fold])
+        for name, fold in missing
+    )
+    for task, result in zip(missing, fitted):
+        results[task] = result
+        if cache is not None:
+            cache.set(keys[task], result)
+
+    oof_proba = np.empty((len(y), len(estimators)))
+    for j, name in enumerate(estimators):
+        for fold, (_, test_idx) in enumerate(splits):
+            result = results[name, fold]
+            if 'proba' not in result:
+                # Запись без вероятностей: считаем их по сохраненной модели фолда
+                result['proba'] = result['model'].predict_proba(_take(X, test_idx))
+                if cache is not None:
+                    cache.set(keys[name, fold], result)
+            oof_proba[test_idx, j] = result['proba'][:, 1]
+    models = {name: results[name, FULL_FIT]['model'] for name in estimators}
+    return pd.DataFrame(oof_proba, columns=list(estimators)), models
+
+
+class StackedClassifier(BaseEstimator, ClassifierMixin):
+    """Стекинг базовых моделей с метамоделью, обученной на их вероятностях вне фолда.
+
+    `final_estimator` - метамодель (по умолчанию логистическая регрессия).
+    После `fit` метамодель меняется через `fit_final` или `tune_final` без
+    обучения базовых моделей.
+    """
+
+    def __init__(self, estimators, final_estimator=None, cv=5, n_jobs=-1, cache=None):
+        self.estimators = estimators
+        self.final_estimator = final_estimator
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.cache = cache
+
+    def fit(self, X, y):
+        self.oof_proba_, self.estimators_ = fit_base_models(self.estimators, X, y, cv=self.cv,
+                                                            n_jobs=self.n_jobs, cache=self.cache)
+        self.y_ = np.asarray(y)
+        self.classes_ = np.unique(self.y_)
+        return self.fit_final()
+
+    def fit_final(self, final_estimator=None):
+        """Обучает метамодель (новую, если передана) на сохраненных вероятностях вне фолда."""
+        if final_estimator is not None:
+            self.final_estimator = final_estimator
+        final_estimator = self.final_estimator if self.final_estimator is not None else LogisticRegression()
+        self.final_estimator_ = clone(final_estimator).fit(self.oof_proba_, self.y_)
+        return self
+
+    def tune_final(self, final_estimator, param_grid, cv=5, scoring='accuracy'):
+        """Подбирает параметры метамодели по сетке на вероятностях вне фолда и оставляет лучшую."""
+        search = GridSearchCV(final_estimator, param_grid, cv=cv, scoring=scoring, n_jobs=self.n_jobs)
+        search.fit(self.oof_proba_, self.y_)
+        self.final_estimator = search.best_estimator_
+        self.final_estimator_ = search.best_estimator_
+        return search
+
+    def transform(self, X):
+        """Вероятности выживания от каждой базовой модели - признаки метамодели."""
+        return pd.DataFrame({name: model.predict_proba(X)[:, 1] for name, model in self.estimators_.items()})
+
+    def predict_proba(self, X):
+        return self.final_estimator_.predict_proba(self.transform(X))
+
+    def predict(self, X):
+        return self.final_estimator_.predict(self.transform(X))
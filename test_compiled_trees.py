@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Предсказания экспортированных ансамблей (compiled_trees.py) должны совпадать с sklearn точно.
+
+Проверяются оба способа поиска листьев: по таблицам масок и обходом деревьев
+(используется, когда таблицы больше `MAX_MASK_TABLE_BYTES`).
+
+    python -m pytest test_compiled_trees.py
+"""
+
+import numpy as np
+import pytest
+from sklearn.base import clone
+from sklearn.datasets import make_classification
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+
+import compiled_trees
+from compiled_trees import CompiledEnsemble, export_ensemble
+
+MODELS = {
+    # Неглубокие деревья: до 32 листьев, маски uint32
+    'rf_shallow': RandomForestClassifier(n_estimators=20, max_depth=4, random_state=0),
+    # Деревья до листьев из одной строки: сотни листьев, несколько слов uint64 на маску
+    'rf_deep': RandomForestClassifier(n_estimators=20, random_state=0),
+    'gbc': GradientBoostingClassifier(n_estimators=60, max_depth=3, subsample=0.8, random_state=0),
+}
+
+
+@pytest.fixture(scope='module')
+def data():
+    X, y = make_classification(n_samples=800, n_features=8, n_informative=5, random_state=0)
+    # Признаки с несколькими значениями (как пол, класс и one-hot) попадают в общие таблицы масок
+    X[:, 0] = X[:, 0] > 0
+    X[:, 1] = np.clip(np.round(X[:, 1] * 2), -3, 3)
+    return X[:500], y[:500], X[500:], y[500:]
+
+
+@pytest.mark.parametrize('use_masks', [True, False], ids=['masks', 'traversal'])
+@pytest.mark.parametrize('name', MODELS)
+def test_predictions_match_sklearn(data, name, use_masks, monkeypatch, tmp_path):
+    X_train, y_train, X_test, _ = data
+    if not use_masks:
+        monkeypatch.setattr(compiled_trees, 'MAX_MASK_TABLE_BYTES', 0)
+    model = clone(MODELS[name]).fit(X_train, y_train)
+
+    path = str(tmp_path / 'model.npz')
+    export_ensemble(model).save(path)
+    # Маленький блок: несколько блоков, включая неполный последний
+    compiled = CompiledEnsemble.load(path)
+    compiled.block_size = 128
+    assert compiled._has_masks == use_masks
+
+    np.testing.assert_array_equal(compiled.predict_proba(X_test), model.predict_proba(X_test))
+    np.testing.assert_array_equal(compiled.predict(X_test), model.predict(X_test))
+    # Одна строка: значения листьев складываются другим способом, чем в больших блоках
+    np.testing.assert_array_equal(compiled.predict_proba(X_test[:1]), model.predict_proba(X_test[:1]))
+    if isinstance(model, GradientBoostingClassifier):
+        np.testing.assert_array_equal(compiled.decision_function(X_test), model.decision_function(X_test))
+
+
+@pytest.mark.parametrize('value', [np.nan, np.inf])
+def test_non_finite_input_is_rejected(data, value):
+    X_train, y_train, X_test, _ = data
+    compiled = export_ensemble(clone(MODELS['rf_shallow']).fit(X_train, y_train))
+    X_bad = X_test[:3].copy()
+    X_bad[1, 2] = value
+    with pytest.raises(ValueError):
+        compiled.predict_proba(X_bad)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Признаки из текстовых столбцов Name, Ticket и Cabin.
+
+Все преобразования векторизованы (строковые методы pandas и таблицы
+соответствия), без `.apply` по строкам. Строковые операции выполняются один
+раз для каждого различного значения (`pd.factorize`), а результат
+раскладывается по строкам по кодам значений:
+
+- Title - обращение из имени ("Braund, Mr. Owen Harris" -> Mr), редкие
+  обращения объединяются по таблице `TITLE_MAP`;
+- Group_Size - число пассажиров с тем же билетом; частоты в обучающей выборке
+  считаются один раз по хеш-индексу билетов (`pd.factorize` + `np.bincount`),
+  а на новых данных билеты ищутся в этом индексе (`Index.get_indexer`), и к
+  частоте добавляется сам новый пассажир;
+- Deck и Cabin_Count - палуба (первая буква каюты, U - неизвестна) и число
+  кают в записи;
+- значения с большим числом категорий (билет, префикс билета, каюта,
+  фамилия) хешируются в разреженную матрицу фиксированной ширины
+  (`FeatureHasher`), поэтому память не растет с числом различных билетов.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction import FeatureHasher
+
+TITLES = ['Mr', 'Mrs', 'Miss', 'Master', 'Rare']
+
+# Французские и устаревшие обращения - к основным; все, чего нет в таблице, - Rare
+TITLE_MAP = {
+    'Mr': 'Mr',
+    'Mrs': 'Mrs',
+    'Miss': 'Miss',
+    'Master': 'Master',
+    'Mlle': 'Miss',
+    'Ms': 'Miss',
+    'Mme': 'Mrs',
+}
+
+# U - неизвестная палуба, при one-hot кодировании она отбрасывается
+DECKS = ['U', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'T']
+
+# Признаки, которые добавляет `TextFeatures.transform` (первые категории Title и Deck отбрасываются)
+TEXT_FEATURES = (
+    [f'Title_{title}' for title in TITLES[1:]]
+    + [f'Deck_{deck}' for deck in DECKS[1:]]
+    + ['Cabin_Count', 'Group_Size']
+)
+
+# Узкие типы признаков (см. FEATURE_DTYPES в preprocessing.py); размер группы на десятках
+# миллионов строк может превысить 65535, поэтому он хранится в uint32
+TEXT_FEATURE_DTYPES = {feature: np.uint8 for feature in TEXT_FEATURES}
+TEXT_FEATURE_DTYPES['Group_Size'] = np.uint32
+
+# Столбцы с большим числом категорий, которые хешируются
+HASHED_COLUMNS = ['Ticket', 'Ticket_Prefix', 'Cabin', 'Surname']
+DEFAULT_HASH_FEATURES = 2 ** 10
+
+
+def _per_unique(values, transform):
+    """Применяет строковое преобразование к различным значениям один раз и раскладывает результат по строкам."""
+    codes, uniques = pd.factorize(values)
+    # Пропуск добавляется последним значением: его код -1 указывает как раз на последний элемент
+    result = transform(pd.Series(list(uniques) + [np.nan], dtype=object)).to_numpy()
+    return pd.Series(result[codes], index=values.index)
+
+
+def extract_title(names):
+    """Обращение из имени вида "Фамилия, Обращение. Имя", сведенное к `TITLES`."""
+    def title(unique_names):
+        titles = unique_names.str.extract(r',\s*([^.]+)\.', expand=False).str.strip()
+        return titles.map(TITLE_MAP).fillna('Rare')
+    return _per_unique(names, title)
+
+
+def extract_surname(names):
+    return _per_unique(names, lambda unique_names: unique_names.str.partition(',')[0].str.strip())
+
+
+def ticket_prefix(tickets):
+    return _per_unique(tickets, _ticket_prefix)
+
+
+def _ticket_prefix(tickets):
+    """Буквенный префикс билета без точек и косых черт ("A/5 21171" -> A5), NUM для чисто числовых."""
+    parts = tickets.str.strip().str.rpartition(' ')
+    prefix = parts[0].str.replace(r'[./]', '', regex=True).str.upper()
+    # Билет без пробела: либо номер, либо только буквы (например, LINE)
+    number = parts[2]
+    no_prefix = prefix == ''
+    prefix[no_prefix] = number[no_prefix].where(~number[no_prefix].str.isdigit(), 'NUM').str.upper()
+    return prefix
+
+
+def cabin_deck(cabins):
+    return _per_unique(cabins, lambda unique_cabins: unique_cabins.str[0].fillna('U'))
+
+
+def cabin_count(cabins):
+    """Число кают в записи ("C23 C25 C27" -> 3), 0 если каюта неизвестна."""
+    return _per_unique(cabins, lambda unique_cabins: unique_cabins.str.split().str.len().fillna(0))
+
+
+def _one_hot(values, categories, prefix):
+    codes = pd.Categorical(values, categories=categories).codes
+    return {f'{prefix}_{category}': (codes == i).astype(np.uint8) for i, category in enumerate(categories) if i > 0}
+
+
+class TextFeatures(BaseEstimator, TransformerMixin):
+    """Строит признаки `TEXT_FEATURES` и хешированную матрицу из Name, Ticket и Cabin.
+
+    В `fit` запоминаются частоты билетов. Для строк обучающей выборки
+    (`fit_transform` или `transform(..., training=True)`) размер группы - это
+    частота билета, в которую строка уже входит; для новых строк (`transform`)
+    - частота плюс сам пассажир, так что пассажир с билетом, который в train
+    встречается один раз, получает 2, как и такая же пара в train. Новые
+    пассажиры между собой не считаются: двое с новым общим билетом получают по
+    1. Зато признак строки не зависит от того, какими блоками или
+    мини-пакетами преобразуются данные.
+    """
+
+    def __init__(self, n_hash_features=DEFAULT_HASH_FEATURES):
+        self.n_hash_features = n_hash_features
+
+    def fit(self, data, y=None):
+        codes, tickets = pd.factorize(data['Ticket'])
+        self.ticket_index_ = pd.Index(tickets)
+        self.ticket_counts_ = np.bincount(codes[codes >= 0], minlength=len(tickets))
+        return self
+
+    def group_size(self, tickets, training=False):
+        position = self.ticket_index_.get_indexer(tickets)
+        counts = np.where(position >= 0, self.ticket_counts_[position], 0)
+        # Строка обучающей выборки уже учтена в частоте своего билета, новая - нет
+        return np.maximum(counts, 1) if training else counts + 1
+
+    def fit_transform(self, data, y=None):
+        return self.fit(data).transform(data, training=True)
+
+    def transform(self, data, training=False):
+        features = {}
+        features.update(_one_hot(extract_title(data['Name']), TITLES, 'Title'))
+        features.update(_one_hot(cabin_deck(data['Cabin']), DECKS, 'Deck'))
+        features['Cabin_Count'] = cabin_count(data['Cabin'])
+        features['Group_Size'] = self.group_size(data['Ticket'], training)
+        result = pd.DataFrame(features, index=data.index)[TEXT_FEATURES]
+        return result.astype(TEXT_FEATURE_DTYPES)
+
+    def transform_hashed(self, data):
+        """Разреженная CSR-матрица (строки x `n_hash_features`, float32) хешей значений `HASHED_COLUMNS`."""
+        columns = {
+            'Ticket': data['Ticket'],
+            'Ticket_Prefix': ticket_prefix(data['Ticket']),
+            'Cabin': data['Cabin'].fillna('U'),
+            'Surname': extract_surname(data['Name']),
+        }
+        hasher = FeatureHasher(n_features=self.n_hash_features, input_type='string',
+                               alternate_sign=False, dtype=np.float32)
+        # Хешируем только различные значения столбца, затем раскладываем их номера столбцов по строкам
+        column_indices = []
+        for column in HASHED_COLUMNS:
+            codes, uniques = pd.factorize(columns[column])
+            # Пропуск добавляется последним значением: его код -1 указывает как раз на последний элемент
+            hashed = hasher.transform([[f'{column}={value}'] for value in list(uniques) + [np.nan]])
+            column_indices.append(hashed.indices[codes])
+        indices = np.column_stack(column_indices).ravel()
+        indptr = np.arange(0, len(indices) + 1, len(HASHED_COLUMNS))
+        matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr),
+                                   shape=(len(data), self.n_hash_features))
+        # Совпавшие хеши разных столбцов одной строки складываются, как в FeatureHasher
+        matrix.sum_duplicates()
+        return matrix
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(TEXT_FEATURES, dtype=object)
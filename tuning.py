@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""Ускоренный подбор гиперпараметров ансамблей деревьев.
+
+`halving_search` строится на тех же `param_grid`, что и GridSearchCV, но
+использует последовательное деление пополам (successive halving): все
+комбинации сначала обучаются с малым бюджетом (числом деревьев или долей
+данных), и на следующий, вдвое больший бюджет переходит только лучшая часть.
+
+`StagedHalvingSearchCV` - деление пополам для леса и градиентного бустинга по
+значениям n_estimators из сетки: на каждом раунде оставшиеся комбинации
+достраиваются до следующего числа деревьев (warm start, без обучения заново),
+поэтому их точность та же, что у полного перебора, и слабая половина
+комбинаций отбрасывается до следующего раунда. Как и любое деление пополам,
+он может отбросить на малом числе деревьев комбинацию, которая лучше всех на
+большом, и тогда найденные параметры отличаются от полного перебора.
+
+`WarmStartGridSearchCV` дает тот же результат, что и GridSearchCV, но не
+обучает заново ансамбли для каждого значения n_estimators: меньшие ансамбли
+являются префиксами больших. Для каждой комбинации остальных параметров и
+каждого фолда модель обучается один раз, а точность на всех значениях
+n_estimators считается по ходу роста ансамбля. С параметром `cache`
+(`cache.FoldCache`) результаты на фолдах сохраняются на диск, и повторный
+запуск обучает только новые комбинации. Значения n_estimators в ключ записи
+не входят: запись хранит ансамбль на наибольшее число деревьев и точности на
+уже посчитанных значениях. Если в сетку добавить значение больше сохраненного,
+ансамбль достраивается (warm start), а точность на меньшем считается по
+префиксу - первым деревьям леса или стадиям бустинга; заново ничего не
+обучается. Исключение - бустинг с метрикой, отличной от accuracy: его
+префиксы не оцениваются, и запись обучается заново.
+"""
+
+import copy
+import math
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import HalvingGridSearchCV, ParameterGrid, check_cv
+from sklearn.utils.metaestimators import available_if
+
+from cache import data_key, fold_key
+from evaluation import _take
+
+
+def halving_search(estimator, param_grid, X, y, cv=5, scoring='accuracy', factor=2,
+                   resource='n_estimators', n_jobs=-1, random_state=42):
+    """Подбор гиперпараметров последовательным делением пополам.
+
+    При resource='n_estimators' значения n_estimators из сетки становятся
+    бюджетами: их число задает количество раундов, а последний раунд
+    обучается с максимальным числом деревьев из сетки. При resource='n_samples'
+    бюджетом служит размер обучающей выборки, а сетка используется как есть.
+    """
+    param_grid = dict(param_grid)
+    if resource == 'n_estimators':
+        budgets = sorted(param_grid.pop('n_estimators'))
+        max_resources = budgets[-1]
+        # Бюджет последнего раунда совпадает с максимальным n_estimators из сетки
+        min_resources = max(1, max_resources // factor ** (len(budgets) - 1))
+    else:
+        max_resources = 'auto'
+        min_resources = 'exhaust'
+
+    search = HalvingGridSearchCV(estimator, param_grid, factor=factor, resource=resource,
+                                 min_resources=min_resources, max_resources=max_resources,
+                                 cv=cv, scoring=scoring, n_jobs=n_jobs, random_state=random_state)
+    start = time.perf_counter()
+    search.fit(X, y)
+    search.search_time_ = time.perf_counter() - start
+    return search
+
+
+def _base_key(params):
+    """Комбинация параметров без n_estimators в виде ключа словаря."""
+    return tuple(sorted((k, v) for k, v in params.items() if k != 'n_estimators'))
+
+
+def _grow_stages(estimator, params, model, n_estimators, X, y, train_idx, test_idx):
+    """Достраивает ансамбль на фолде до `n_estimators` деревьев и возвращает его точность."""
+    if model is None:
+        model = clone(estimator).set_params(**params, warm_start=True)
+    start = time.perf_counter()
+    model.set_params(n_estimators=n_estimators).fit(_take(X, train_idx), _take(y, train_idx))
+    # accuracy_score тратит на проверки входа больше времени, чем на само сравнение
+    score = np.mean(model.predict(_take(X, test_idx)) == np.asarray(_take(y, test_idx)))
+    return {'model': model, 'score': score, 'fit_time': time.perf_counter() - start}
+
+
+class StagedHalvingSearchCV(BaseEstimator):
+    """Последовательное деление пополам для леса или градиентного бустинга по числу деревьев.
+
+    Раунды соответствуют значениям n_estimators из `param_grid`. На каждом
+    раунде ансамбль каждой оставшейся комбинации остальных параметров
+    достраивается на каждом фолде до очередного числа деревьев через warm start
+    (достроенный лес или бустинг совпадает с обученным сразу), поэтому точность
+    каждой оцененной комбинации та же, что у GridSearchCV. Перед следующим
+    раундом остается лучшая 1/`factor` часть комбинаций по лучшей точности на
+    уже пройденных значениях n_estimators. Метрика - accuracy.
+    """
+
+    def __init__(self, estimator, param_grid, cv=5, factor=2, n_jobs=-1, refit=True):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.factor = factor
+        self.n_jobs = n_jobs
+        self.refit = refit
+
+    def fit(self, X, y):
+        splits = list(check_cv(self.cv, y, classifier=True).split(X, y))
+        n_splits = len(splits)
+        grid = dict(self.param_grid)
+        checkpoints = sorted(grid.pop('n_estimators'))
+        base_candidates = list(ParameterGrid(grid))
+
+        start = time.perf_counter()
+        models = {}
+        # Точности и время обучения по фолдам для каждой оцененной пары (комбинация, n_estimators)
+        evaluated = {}
+        fit_times = {}
+        alive = list(range(len(base_candidates)))
+        self.n_candidates_ = []
+        for round_index, budget in enumerate(checkpoints):
+            self.n_candidates_.append(len(alive))
+            tasks = [(i, fold) for i in alive for fold in range(n_splits)]
+            results = Parallel(n_jobs=self.n_jobs)(
+                delayed(_grow_stages)(self.estimator, base_candidates[i], models.get((i, fold)), budget, X, y,
+                                      *splits[fold])
+                for i, fold in tasks
+            )
+            for (i, fold), result in zip(tasks, results):
+                models[i, fold] = result['model']
+                # Меньшие значения n_estimators оставшихся комбинаций оценены на прошлых раундах
+                evaluated.setdefault((i, budget), [None] * n_splits)[fold] = result['score']
+                fit_times.setdefault(i, [0.0] * n_splits)[fold] += result['fit_time']
+
+            if round_index < len(checkpoints) - 1:
+                def best_so_far(i):
+                    return max(np.mean(evaluated[i, n]) for n in checkpoints[:round_index + 1])
+
+                # Порядок сортировки устойчив: при равной точности остается комбинация, раньше идущая в сетке
+                n_keep = max(1, math.ceil(len(alive) / self.factor))
+                alive = sorted(alive, key=lambda i: -best_so_far(i))[:n_keep]
+                models = {key: model for key, model in models.items() if key[0] in alive}
+
+        # Раскладываем результаты в порядке ParameterGrid, как в GridSearchCV; отброшенные
+        # на ранних раундах значения n_estimators в cv_results_ не попадают
+        index = {_base_key(params): i for i, params in enumerate(base_candidates)}
+        candidates, split_scores, mean_fit_times = [], [], []
+        for params in ParameterGrid(self.param_grid):
+            i = index[_base_key(params)]
+            if (i, params['n_estimators']) in evaluated:
+                candidates.append(params)
+                split_scores.append(evaluated[i, params['n_estimators']])
+                mean_fit_times.append(np.mean(fit_times[i]))
+        split_scores = np.array(split_scores)
+        mean_scores = split_scores.mean(axis=1)
+
+        self.cv_results_ = {'params': candidates}
+        for k in range(n_splits):
+            self.cv_results_[f'split{k}_test_score'] = split_scores[:, k]
+        self.cv_results_['mean_test_score'] = mean_scores
+        self.cv_results_['std_test_score'] = split_scores.std(axis=1)
+        self.cv_results_['rank_test_score'] = np.searchsorted(np.sort(-mean_scores), -mean_scores) + 1
+        # Суммарное время достраивания комбинации на фолде по всем пройденным раундам
+        self.cv_results_['mean_fit_time'] = np.array(mean_fit_times)
+
+        self.n_splits_ = n_splits
+        self.best_index_ = int(np.argmax(mean_scores))
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = mean_scores[self.best_index_]
+        self.search_time_ = time.perf_counter() - start
+
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)
+
+
+def uncached_search_time(search, X, y):
+    """Время полного перебора `search` (WarmStartGridSearchCV) без дискового кэша.
+
+    Если результаты были взяты из кэша, перебор повторяется с `cache=None`,
+    чтобы сравнивать с другими способами поиска время самого обучения.
+    """
+    if search.cache is None or search.n_cached_fits_ + search.n_extended_fits_ == 0:
+        return search.search_time_
+    return clone(search).set_params(cache=None, refit=False).fit(X, y).search_time_
+
+
+def print_search_comparison(name, exhaustive_params, exhaustive_score, exhaustive_time, search):
+    """Выводит время и результат ускоренного поиска рядом с полным перебором (без кэша)."""
+    n_fits = int(sum(search.n_candidates_) * search.n_splits_)
+    same = all(exhaustive_params.get(key) == value for key, value in search.best_params_.items())
+    print(f'{name}: полный перебор {exhaustive_time:.1f} с, точность {exhaustive_score:.4f}')
+    print(f'{name}: деление пополам {search.search_time_:.1f} с ({n_fits} обучений), '
+          f'точность {search.best_score_:.4f}, параметры {search.best_params_}')
+    if same:
+        print('Параметры совпадают с полным перебором: да')
+    else:
+        print('Параметры совпадают с полным перебором: нет (известное ограничение деления пополам: '
+              'лучшая на полном числе деревьев комбинация была отброшена на меньшем)')
+
+
+def _prefix_scores(model, n_values, X_test, y_test, scoring):
+    """Точность префиксов обученного ансамбля на n_estimators из `n_values` без обучения (None - нельзя)."""
+    if hasattr(model, 'staged_predict'):
+        if scoring != 'accuracy':
+            return None
+        wanted = set(n_values)
+        scores = {}
+        for n_stages, pred in enumerate(model.staged_predict(X_test), start=1):
+            if n_stages in wanted:
+                scores[n_stages] = np.mean(pred == np.asarray(y_test))
+        return scores
+    # Лес с warm_start: первые n деревьев - это в точности лес на n деревьев
+    scorer = check_scoring(model, scoring=scoring)
+    scores = {}
+    for n_estimators in n_values:
+        prefix = copy.copy(model)
+        prefix.estimators_ = model.estimators_[:n_estimators]
+        prefix.n_estimators = n_estimators
+        scores[n_estimators] = scorer(prefix, X_test, y_test)
+    return scores
+
+
+def _fit_checkpoints(estimator, params, checkpoints, X, y, train_idx, test_idx, scoring, previous=None):
+    """Обучает ансамбль один раз и возвращает точность на каждом значении n_estimators.
+
+    `previous` - запись кэша с тем же ансамблем на других значениях
+    n_estimators: ансамбль достраивается до `checkpoints[-1]`, если он меньше,
+    а точности на недостающих значениях считаются по его префиксам.
+    """
+    X_train, y_train = _take(X, train_idx), _take(y, train_idx)
+    X_test, y_test = _take(X, test_idx), _take(y, test_idx)
+    scores, fit_time, model = {}, 0.0, None
+    if previous is not None:
+        scores, fit_time, model = dict(previous['scores']), previous['fit_time'], previous['model']
+    missing = [n_estimators for n_estimators in checkpoints if n_estimators not in scores]
+    # Префиксы не оцениваются только у бустинга с метрикой, отличной от accuracy
+    prefixes_scored = scoring == 'accuracy' or not hasattr(estimator, 'staged_predict')
+    if model is not None and not prefixes_scored and missing[0] < model.n_estimators:
+        scores, fit_time, model = {}, 0.0, None
+        missing = list(checkpoints)
+
+    start = time.perf_counter()
+    if prefixes_scored:
+        # Одно обучение (или достраивание) до наибольшего значения, точности - по префиксам
+        if model is None or missing[-1] > model.n_estimators:
+            if model is None:
+                model = clone(estimator).set_params(**params, warm_start=True)
+            model.set_params(n_estimators=missing[-1]).fit(X_train, y_train)
+        scores.update(_prefix_scores(model, missing, X_test, y_test, scoring))
+    else:
+        # Бустинг с другой метрикой: достраиваем деревья через warm_start и оцениваем каждое значение
+        if model is None:
+            model = clone(estimator).set_params(**params, warm_start=True)
+        scorer = check_scoring(model, scoring=scoring)
+        for n_estimators in missing:
+            model.set_params(n_estimators=n_estimators).fit(X_train, y_train)
+            scores[n_estimators] = scorer(model, X_test, y_test)
+    fit_time += time.perf_counter() - start
+    return {'scores': scores, 'fit_time': fit_time, 'model': model}
+
+
+class WarmStartGridSearchCV(BaseEstimator):
+    """Полный перебор сетки с общим обучением для всех значений n_estimators.
+
+    Результаты (`best_params_`, `best_score_`, `cv_results_`) совпадают с
+    GridSearchCV на тех же фолдах, а число обучений сокращается в
+    len(param_grid['n_estimators']) раз. `n_cached_fits_` - число пар
+    (комбинация, фолд), полностью взятых из кэша, `n_extended_fits_` - число
+    пар, для которых сохраненный ансамбль достроен или оценен на новых значениях
+    n_estimators.
+    """
+
+    def __init__(self, estimator, param_grid, cv=5, scoring='accuracy', n_jobs=-1, refit=True, cache=None):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.refit = refit
+        self.cache = cache
+
+    def fit(self, X, y):
+        splits = list(check_cv(self.cv, y, classifier=True).split(X, y))
+        grid = dict(self.param_grid)
+        checkpoints = sorted(grid.pop('n_estimators'))
+        base_candidates = list(ParameterGrid(grid))
+
+        start = time.perf_counter()
+        tasks = [(params, fold, train_idx, test_idx)
+                 for params in base_candidates for fold, (train_idx, test_idx) in enumerate(splits)]
+        results = [None] * len(tasks)
+        if self.cache is not None:
+            data_hash = data_key(X, y)
+            # n_estimators в ключ не входят: запись достраивается при расширении сетки
+            keys = [fold_key(data_hash, self.estimator, params, fold, test_idx, scoring=self.scoring)
+                    for params, fold, _, test_idx in tasks]
+            results = [self.cache.get(key) for key in keys]
+
+        # Обучаем только комбинации, которых нет в кэше, и достраиваем записи без нужных n_estimators
+        missing = [i for i, result in enumerate(results)
+                   if result is None or not set(checkpoints) <= set(result['scores'])]
+        fitted = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_checkpoints)(self.estimator, tasks[i][0], checkpoints, X, y, tasks[i][2], tasks[i][3],
+                                      self.scoring, results[i])
+            for i in missing
+        )
+        self.n_extended_fits_ = sum(results[i] is not None for i in missing)
+        for i, result in zip(missing, fitted):
+            results[i] = result
+            if self.cache is not None:
+                self.cache.set(keys[i], result)
+        self.n_cached_fits_ = len(tasks) - len(missing)
+
+        # Раскладываем точности по комбинациям в порядке ParameterGrid, как в GridSearchCV
+        n_splits = len(splits)
+        lookup = {}
+        for i, params in enumerate(base_candidates):
+            for n_estimators in checkpoints:
+                fold_results = results[i * n_splits:(i + 1) * n_splits]
+                lookup[self._key(params, n_estimators)] = (
+                    [result['scores'][n_estimators] for result in fold_results],
+                    [result['fit_time'] for result in fold_results],
+                )
+
+        candidates = list(ParameterGrid(self.param_grid))
+        split_scores = np.array([lookup[self._key(p, p['n_estimators'])][0] for p in candidates])
+        fit_times = np.array([lookup[self._key(p, p['n_estimators'])][1] for p in candidates])
+        mean_scores = split_scores.mean(axis=1)
+
+        self.cv_results_ = {'params': candidates}
+        for k in range(n_splits):
+            self.cv_results_[f'split{k}_test_score'] = split_scores[:, k]
+        self.cv_results_['mean_test_score'] = mean_scores
+        self.cv_results_['std_test_score'] = split_scores.std(axis=1)
+        # Ранги как в GridSearchCV: одинаковые значения получают одинаковый (минимальный) ранг
+        self.cv_results_['rank_test_score'] = np.searchsorted(np.sort(-mean_scores), -mean_scores) + 1
+        # Время одного общего обучения на фолде, приходящееся на комбинацию
+        self.cv_results_['mean_fit_time'] = fit_times.mean(axis=1)
+
+        self.n_splits_ = n_splits
+        self.best_index_ = int(np.argmax(mean_scores))
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = mean_scores[self.best_index_]
+        self.search_time_ = time.perf_counter() - start
+
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        return self
+
+    @staticmethod
+    def _key(params, n_estimators):
+        return _base_key(params), n_estimators
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    @available_if(lambda self: hasattr(self.estimator, 'predict_proba'))
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)